@@ -1,17 +1,34 @@
 import os
-import requests
 import hashlib
-from flask import Flask, request, jsonify, send_from_directory
+import hmac
+from functools import wraps
+from flask import Flask, Request, Response, g, request, jsonify, redirect, send_from_directory
 from flask_cors import CORS
+from werkzeug.exceptions import NotFound, RequestEntityTooLarge
 from urllib.parse import urlparse, quote
 import mimetypes
 from datetime import datetime
 import logging
+import json
+import uuid
+import tempfile
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from image_index import ImageIndex, legacy_content_key
+import http_client
+import image_storage
+import image_bundle
+from exam_csv import iter_csv_image_references
+from single_flight import SingleFlight
+from negative_cache import NegativeCache, RecentlyFailedError
+import metrics
 # Import Cloudinary SDK (now properly installed)
 try:
     import cloudinary
     import cloudinary.uploader
-    import cloudinary.config
     import cloudinary.api
     import cloudinary.exceptions
     CLOUDINARY_AVAILABLE = True
@@ -24,6 +41,13 @@ except Exception as e:
     CLOUDINARY_AVAILABLE = False
     cloudinary = None
     print(f"🔍 DEBUG: Unexpected error importing Cloudinary: {e}")
+# Pillow is optional - without it /api/images always serves the original
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    Image = None
+    PIL_AVAILABLE = False
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -33,9 +57,105 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Configuration
-IMAGES_DIR = 'processed_images'
+IMAGES_DIR = os.environ.get('IMAGES_DIR', 'processed_images')
+IMAGE_INDEX_DB = os.environ.get('IMAGE_INDEX_DB', 'image_index.db')
+LOCAL_STORAGE = 'local'  # Name of the local image store's counters in the index
+STATS_RECONCILE_INTERVAL = int(os.environ.get('STATS_RECONCILE_INTERVAL', 3600))  # Seconds between full disk scans
+LOCAL_STORAGE_QUOTA = int(float(os.environ.get('LOCAL_STORAGE_QUOTA_MB', 0)) * 1024 * 1024)  # Bytes, 0 = unlimited
+EVICTION_TARGET_RATIO = 0.9  # Evict down to this share of the quota, so eviction doesn't run on every write
+EVICTION_INTERVAL = int(os.environ.get('EVICTION_INTERVAL', 60))  # Seconds between quota checks
+ACCESS_FLUSH_INTERVAL = 30  # Seconds between writes of buffered image access times
+HEALTH_PROBE_INTERVAL = int(os.environ.get('HEALTH_PROBE_INTERVAL', 30))  # Seconds between Cloudinary pings
+HEALTH_PROBE_TIMEOUT = int(os.environ.get('HEALTH_PROBE_TIMEOUT', 10))  # Seconds before a ping counts as failed
 ALLOWED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp'}
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB limit
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # Bytes held in memory per download/upload at a time
+UPLOAD_FORM_OVERHEAD = 64 * 1024  # Multipart headers and boundaries allowed on top of MAX_FILE_SIZE
+UPLOAD_SOURCE_PREFIX = 'upload:'  # Index alias of directly uploaded images (they have no source URL)
+DOWNLOAD_ATTEMPTS = int(os.environ.get('IMAGE_DOWNLOAD_ATTEMPTS', 2))  # Tries per origin image
+IMAGE_CACHE_MAX_AGE = int(os.environ.get('IMAGE_CACHE_MAX_AGE', 365 * 24 * 3600))  # Stored images never change
+
+# How local image bytes are sent:
+#   'direct'           - wsgi.file_wrapper (gunicorn uses sendfile), with Range support
+#   'x-sendfile'       - X-Sendfile header for Apache/lighttpd to send the file
+#   'x-accel-redirect' - X-Accel-Redirect header for nginx, under IMAGE_ACCEL_PREFIX
+IMAGE_SEND_MODE = os.environ.get('IMAGE_SEND_MODE', 'direct').lower()
+IMAGE_ACCEL_PREFIX = os.environ.get('IMAGE_ACCEL_PREFIX', '/_internal').rstrip('/')  # nginx internal locations, one per store
+app.config['USE_X_SENDFILE'] = IMAGE_SEND_MODE == 'x-sendfile'
+
+# Resized/transcoded variants of local images, generated once and kept on disk
+VARIANTS_DIR = os.environ.get('IMAGE_VARIANTS_DIR', 'processed_variants')
+MAX_VARIANT_DIMENSION = 2048
+# Requested sizes and qualities snap to these, bounding the variants one image can have
+VARIANT_SIZES = (240, 480, 960, 1920)
+VARIANT_QUALITIES = (50, 65, 80, 90)
+VARIANT_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG', 'png': 'PNG'}
+DEFAULT_VARIANT_QUALITY = 80
+# Larger sources are refused instead of decoded; Pillow's own limit only warns up to ~178M pixels
+MAX_VARIANT_SOURCE_PIXELS = int(os.environ.get('MAX_VARIANT_SOURCE_PIXELS', 40_000_000))
+if PIL_AVAILABLE:
+    Image.MAX_IMAGE_PIXELS = MAX_VARIANT_SOURCE_PIXELS
+    warnings.simplefilter('error', Image.DecompressionBombWarning)
+
+# nginx internal location under IMAGE_ACCEL_PREFIX aliasing each local store
+ACCEL_LOCATIONS = {IMAGES_DIR: 'images', VARIANTS_DIR: 'variants'}
+
+# Per-exam offline image bundles (one tar + manifest per exam CSV)
+BUNDLES_DIR = os.environ.get('IMAGE_BUNDLES_DIR', 'processed_bundles')
+EXAM_CSV_DIR = os.environ.get('EXAM_CSV_DIR', 'csv')
+BUNDLE_RETRY_AFTER = 5  # Seconds clients should wait while a bundle is being built
+
+# Batch processing concurrency
+MAX_WORKERS = int(os.environ.get('IMAGE_MAX_WORKERS', 8))  # Images processed in parallel per batch
+PER_HOST_LIMIT = int(os.environ.get('IMAGE_PER_HOST_LIMIT', 4))  # Concurrent downloads per origin host
+SKIP_DOMAINS = ['image-processing-server', 'onrender.com', 'cloudinary.com']
+
+# Failed downloads are not retried until their backoff window (doubled per failure) ends
+NEGATIVE_CACHE_BASE = int(os.environ.get('NEGATIVE_CACHE_BASE', 60))  # Seconds after the first failure
+NEGATIVE_CACHE_MAX = int(os.environ.get('NEGATIVE_CACHE_MAX', 24 * 3600))  # Longest backoff, seconds
+
+# Token for /api/admin/* endpoints; they are disabled when unset
+ADMIN_API_TOKEN = os.environ.get('ADMIN_API_TOKEN')
+
+# Cloudinary
+CLOUDINARY_FOLDER = 'examtopic_images'
+CLOUDINARY_LOOKUP_BATCH_SIZE = 100  # Max public IDs per Admin API resources_by_ids call
+CLOUDINARY_UPLOAD_PREFIX = os.environ.get('CLOUDINARY_UPLOAD_PREFIX')  # API base URL override, e.g. a local stand-in
+
+# Write-behind: save locally, answer immediately, upload to Cloudinary in the background
+WRITE_BEHIND_ENABLED = os.environ.get('CLOUDINARY_WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')
+# Mount point of a persistent disk; write-behind needs its queue and local copies to survive restarts
+PERSISTENT_DATA_DIR = os.environ.get('PERSISTENT_DATA_DIR')
+
+def is_on_persistent_disk(path):
+    """Whether path lives under PERSISTENT_DATA_DIR"""
+    if not PERSISTENT_DATA_DIR:
+        return False
+    root = os.path.realpath(PERSISTENT_DATA_DIR)
+    return os.path.commonpath([root, os.path.realpath(path)]) == root
+
+if WRITE_BEHIND_ENABLED and not (is_on_persistent_disk(IMAGES_DIR) and is_on_persistent_disk(IMAGE_INDEX_DB)):
+    # On an ephemeral disk a restart before promotion loses the only copy and the queue
+    logger.error("❌ CLOUDINARY_WRITE_BEHIND needs IMAGES_DIR and IMAGE_INDEX_DB under PERSISTENT_DATA_DIR; "
+                 "uploading synchronously instead")
+    WRITE_BEHIND_ENABLED = False
+PROMOTION_WORKERS = int(os.environ.get('PROMOTION_WORKERS', 2))  # Concurrent background uploads per worker
+PROMOTION_MAX_ATTEMPTS = int(os.environ.get('PROMOTION_MAX_ATTEMPTS', 10))
+PROMOTION_RETRY_BASE = int(os.environ.get('PROMOTION_RETRY_BASE', 30))  # Seconds, doubled per failed attempt
+PROMOTION_RETRY_MAX = 3600  # Seconds
+PROMOTION_LEASE = 300  # Seconds before a claimed upload is considered abandoned
+
+# Asynchronous batch jobs, processed in the background and persisted item by item
+JOB_WORKERS = int(os.environ.get('IMAGE_JOB_WORKERS', 1))  # Jobs run concurrently per worker
+JOB_CHUNK_SIZE = int(os.environ.get('IMAGE_JOB_CHUNK_SIZE', 50))  # Items handed to the batch pool at a time
+JOB_MAX_URLS = int(os.environ.get('IMAGE_JOB_MAX_URLS', 10000))
+JOB_LEASE = 300  # Seconds without progress before a running job is resumed elsewhere
+JOB_RETENTION = int(os.environ.get('IMAGE_JOB_RETENTION', 7 * 24 * 3600))  # Seconds completed jobs are kept
+JOB_STREAM_DURATION = 20  # Seconds per event stream connection, under gunicorn's worker timeout
+
+# Prometheus metrics are kept per worker and merged through snapshot files in METRICS_DIR
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'image-server-metrics'))
+METRICS_PUBLISH_INTERVAL = 5  # Seconds between snapshot writes
 
 # Configure Cloudinary SDK
 CLOUDINARY_ENABLED = False
@@ -46,6 +166,8 @@ if CLOUDINARY_AVAILABLE:
             api_key=os.environ.get('CLOUDINARY_API_KEY'),
             api_secret=os.environ.get('CLOUDINARY_API_SECRET')
         )
+        if CLOUDINARY_UPLOAD_PREFIX:
+            cloudinary.config(upload_prefix=CLOUDINARY_UPLOAD_PREFIX)
         CLOUDINARY_ENABLED = all([
             os.environ.get('CLOUDINARY_CLOUD_NAME'),
             os.environ.get('CLOUDINARY_API_KEY'),
@@ -63,8 +185,71 @@ if CLOUDINARY_AVAILABLE:
 else:
     logger.warning("⚠️ Cloudinary library not available, using local storage only")
 
+# Not every platform's mime.types knows these
+mimetypes.add_type('image/webp', '.webp')
+mimetypes.add_type('image/bmp', '.bmp')
+
 # Create images directory if it doesn't exist (fallback)
 os.makedirs(IMAGES_DIR, exist_ok=True)
+os.makedirs(VARIANTS_DIR, exist_ok=True)
+
+# Persistent URL -> stored image index, checked before any remote lookup
+image_index = ImageIndex(IMAGE_INDEX_DB)
+
+# Shared worker pool for batch processing (threads are started lazily, after gunicorn forks)
+image_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='image-worker')
+host_semaphores = {}
+host_semaphores_lock = threading.Lock()
+
+# Concurrent requests for the same image share one download/upload/resize
+url_flights = SingleFlight()
+content_flights = SingleFlight()
+variant_flights = SingleFlight()
+
+# Origin URLs that failed recently, answered with an immediate error (shared by all workers)
+negative_cache = NegativeCache(image_index, NEGATIVE_CACHE_BASE, NEGATIVE_CACHE_MAX)
+
+# Background threads are started per process, on the first request after fork
+background_tasks_pid = None
+background_tasks_lock = threading.Lock()
+
+# Latest Cloudinary probe result, refreshed in the background and served by /api/health
+cloudinary_probe = {
+    'status': 'disabled' if not CLOUDINARY_ENABLED else 'pending',
+    'latencyMs': None,
+    'checkedAt': None
+}
+cloudinary_probe_lock = threading.Lock()
+
+# Set when this process queues a job, so its job runner picks it up without waiting
+job_wakeup = threading.Event()
+
+# Exams whose bundle this process is building
+bundle_builds = set()
+bundle_builds_lock = threading.Lock()
+
+# Local image accesses since the last flush, for LRU eviction (filename -> timestamp)
+local_accesses = {}
+local_accesses_lock = threading.Lock()
+
+# Metrics, exposed at /metrics
+metrics_registry = metrics.Registry()
+stage_seconds = metrics_registry.histogram(
+    'image_stage_duration_seconds', 'Time spent in each image processing stage', ['stage', 'outcome'])
+process_seconds = metrics_registry.histogram(
+    'image_process_duration_seconds', 'Time to resolve one image URL to a stored URL', ['outcome'])
+cache_lookups = metrics_registry.counter(
+    'image_cache_lookups_total', 'Lookups of already stored images', ['cache', 'result'])
+download_bytes = metrics_registry.counter(
+    'image_download_bytes_total', 'Image bytes downloaded from origins')
+upload_bytes = metrics_registry.counter(
+    'image_upload_bytes_total', 'Image bytes uploaded to Cloudinary')
+in_flight = metrics_registry.gauge(
+    'image_in_flight', 'Operations currently running', ['stage'])
+http_request_seconds = metrics_registry.histogram(
+    'http_request_duration_seconds', 'HTTP request handling time', ['endpoint', 'method', 'status'])
+http_response_bytes = metrics_registry.counter(
+    'http_response_bytes_total', 'HTTP response body bytes with a known length', ['endpoint'])
 
 def get_file_extension(url):
     """Extract file extension from URL"""
@@ -76,37 +261,88 @@ def get_file_extension(url):
     return '.png'  # Default to PNG
 
 def generate_filename(url):
-    """Generate a unique filename for the image"""
+    """Generate the legacy URL-hash filename used before content addressing"""
     # Create a hash of the URL to avoid conflicts
     url_hash = hashlib.md5(url.encode()).hexdigest()[:8]
     ext = get_file_extension(url)
     return f"{url_hash}{ext}"
 
+def content_filename(content_hash, url):
+    """Generate the content-addressed filename for an image"""
+    return f"{content_hash}{get_file_extension(url)}"
+
+class ImageTooLargeError(ValueError):
+    """Raised when an image exceeds MAX_FILE_SIZE"""
+
+def classify_download_failure(error):
+    """Failure class of a download error, or None if the origin is not to blame
+    
+    Malformed URLs (MissingSchema, InvalidSchema, InvalidURL) fail without a
+    network round-trip, so they are not cached.
+    """
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        if status in (404, 410):
+            return 'not_found'
+        return 'server_error' if status >= 500 else 'client_error'
+    if isinstance(error, requests.Timeout):
+        return 'timeout'
+    if isinstance(error, requests.ConnectionError):
+        return 'connection'
+    if isinstance(error, ImageTooLargeError):
+        return 'too_large'
+    return None
+
 def download_image(url):
-    """Download image from URL"""
+    """Stream image from URL into a temporary file
+    
+    The body is hashed as it arrives and the download is aborted as soon as it
+    exceeds MAX_FILE_SIZE. Returns (temp_path, content_hash, size); the caller
+    owns the temp file.
+    """
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.9',
+    }
+    
+    # Temp file lives next to the final images so the local save is a rename
+    fd, temp_path = tempfile.mkstemp(dir=IMAGES_DIR, prefix='.download-', suffix='.part')
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Connection': 'keep-alive',
-        }
-        
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
-        
-        # Check file size
-        if len(response.content) > MAX_FILE_SIZE:
-            raise ValueError(f"File too large: {len(response.content)} bytes")
+        with os.fdopen(fd, 'wb') as f:
+            # Images are already compressed, so don't ask the origin to encode them again
+            with http_client.get(url, headers=headers, stream=True, decompress=False,
+                                 max_attempts=DOWNLOAD_ATTEMPTS) as response:
+                response.raise_for_status()
+                
+                # Reject early if the origin announces an oversized body
+                content_length = response.headers.get('Content-Length', '')
+                if content_length.isdigit() and int(content_length) > MAX_FILE_SIZE:
+                    raise ImageTooLargeError(f"File too large: {content_length} bytes")
+                
+                hasher = hashlib.sha256()
+                size = 0
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > MAX_FILE_SIZE:
+                        raise ImageTooLargeError(f"File too large: more than {MAX_FILE_SIZE} bytes")
+                    hasher.update(chunk)
+                    f.write(chunk)
         
-        return response.content
+        return temp_path, hasher.hexdigest(), size
     except Exception as e:
         logger.error(f"Failed to download image from {url}: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
         raise
 
 def upload_to_cloudinary(image_data, public_id):
-    """Upload image to Cloudinary with fallback to local storage"""
+    """Upload image to Cloudinary with fallback to local storage
+    
+    image_data may be raw bytes or the path of a file on disk. public_id is
+    the content hash, so with overwrite=False an image Cloudinary already has
+    (e.g. after the index was lost on a redeploy) is returned as it is.
+    """
     if not CLOUDINARY_ENABLED:
         logger.debug("Cloudinary not enabled, skipping upload")
         return None
@@ -115,20 +351,22 @@ def upload_to_cloudinary(image_data, public_id):
         logger.info(f"🌩️ Uploading image to Cloudinary: {public_id}")
         
         # Upload to Cloudinary
-        result = cloudinary.uploader.upload(
-            image_data,
-            public_id=public_id,
-            folder="examtopic_images",  # Organize images in a folder
-            resource_type="image",
-            overwrite=True,  # Replace if exists
-            transformation=[
-                {'quality': 'auto:good'},  # Optimize quality
-                {'fetch_format': 'auto'}   # Auto format (WebP when supported)
-            ]
-        )
+        with in_flight.track_in_progress(stage='upload'), stage_seconds.time(stage='cloudinary_upload'):
+            result = cloudinary.uploader.upload(
+                image_data,
+                public_id=public_id,
+                folder=CLOUDINARY_FOLDER,  # Organize images in a folder
+                resource_type="image",
+                overwrite=False,  # Same public ID means same bytes
+                transformation=[
+                    {'quality': 'auto:good'},  # Optimize quality
+                    {'fetch_format': 'auto'}   # Auto format (WebP when supported)
+                ]
+            )
         
         cloudinary_url = result.get('secure_url')
         if cloudinary_url:
+            upload_bytes.inc(len(image_data) if isinstance(image_data, bytes) else os.path.getsize(image_data))
             logger.info(f"✅ Successfully uploaded to Cloudinary: {cloudinary_url}")
             return cloudinary_url
         else:
@@ -139,27 +377,418 @@ def upload_to_cloudinary(image_data, public_id):
         logger.error(f"❌ Cloudinary upload failed: {e}")
         return None
 
-def save_image_with_cloudinary_fallback(url, image_data):
-    """Save image to Cloudinary with local fallback"""
-    filename = generate_filename(url)
-    public_id = filename.split('.')[0]  # Remove extension for Cloudinary
+def save_image_with_cloudinary_fallback(url, temp_path, content_hash, size):
+    """Save a downloaded image to Cloudinary with local fallback
     
-    # Try Cloudinary first
-    cloudinary_url = upload_to_cloudinary(image_data, public_id)
-    if cloudinary_url:
-        return cloudinary_url
+    Storage is keyed on the content hash, so identical bytes reached through
+    different URLs are stored once, and concurrent saves of the same bytes
+    wait for a single upload. Consumes the temp file produced by
+    download_image().
+    """
+    try:
+        stored_url, shared = content_flights.do(content_hash, store_image_content, url, temp_path, content_hash, size)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    
+    if shared:
+        image_index.record_alias(url, content_hash)
+    return stored_url
+
+def store_image_content(url, temp_path, content_hash, size):
+    """Store new image bytes once, recording url as their first alias"""
+    # Same bytes already stored under another URL - just add an alias
+    existing_url = lookup_indexed_content(content_hash)
+    cache_lookups.inc(cache='content', result='hit' if existing_url else 'miss')
+    if existing_url:
+        logger.info(f"♻️ Identical image already stored, aliasing: {url}")
+        image_index.record_alias(url, content_hash)
+        return existing_url
     
-    # Fallback to local storage
-    logger.info(f"📁 Falling back to local storage for: {filename}")
-    filepath = os.path.join(IMAGES_DIR, filename)
+    # Try Cloudinary first, uploading straight from disk
+    write_behind = CLOUDINARY_ENABLED and WRITE_BEHIND_ENABLED
+    if not write_behind:
+        cloudinary_url = upload_to_cloudinary(temp_path, content_hash)
+        if cloudinary_url:
+            image_index.record(url, content_hash, cloudinary_url, 'cloudinary', size)
+            return cloudinary_url
+    
+    # Fallback to local storage (or the first step of a write-behind save)
+    filename = content_filename(content_hash, url)
+    if write_behind:
+        logger.info(f"📁 Saving locally, Cloudinary upload queued: {filename}")
+    else:
+        logger.info(f"📁 Falling back to local storage for: {filename}")
     
     try:
-        with open(filepath, 'wb') as f:
-            f.write(image_data)
-        return f"/api/images/{filename}"
+        store_local_file(temp_path, filename)
     except Exception as e:
         logger.error(f"❌ Failed to save locally: {e}")
         raise
+    
+    local_url = f"/api/images/{filename}"
+    image_index.record(url, content_hash, local_url, 'local', size)
+    if write_behind:
+        image_index.enqueue_promotion(content_hash, filename)
+    return local_url
+
+class UploadSpool:
+    """Temp file in IMAGES_DIR receiving one uploaded file part, hashed as it arrives
+    
+    Raises RequestEntityTooLarge as soon as the part exceeds MAX_FILE_SIZE, so
+    an oversized upload (chunked or not) is not read any further.
+    """
+    
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(dir=IMAGES_DIR, prefix='.upload-', suffix='.part')
+        self.file = os.fdopen(fd, 'w+b')
+        self.hasher = hashlib.sha256()
+        self.size = 0
+    
+    def write(self, data):
+        self.size += len(data)
+        if self.size > MAX_FILE_SIZE:
+            raise RequestEntityTooLarge(f"File too large: more than {MAX_FILE_SIZE} bytes")
+        self.hasher.update(data)
+        return self.file.write(data)
+    
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+    
+    def discard(self):
+        """Close the file and remove it unless it was moved into storage"""
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class ImageServerRequest(Request):
+    """Request whose /api/upload-image file parts are parsed straight into UploadSpools
+    
+    Werkzeug would otherwise spool each part to its own temp file first, so
+    every upload was written to disk twice.
+    """
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint != 'upload_image':
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        spool = UploadSpool()
+        g.setdefault('upload_spools', []).append(spool)
+        return spool
+
+app.request_class = ImageServerRequest
+
+def receive_upload(file):
+    """(temp_path, content_hash, size) of an uploaded file part
+    
+    The part was already written and hashed while the form was parsed. The
+    temp file is closed here and the caller owns it.
+    """
+    spool = file.stream
+    spool.file.close()
+    return spool.path, spool.hasher.hexdigest(), spool.size
+
+def store_local_file(temp_path, filename):
+    """Move a finished temp file into local storage, updating the storage counters"""
+    with stage_seconds.time(stage='local_write'):
+        filepath = image_storage.prepare_path(IMAGES_DIR, filename)
+        replaced_size = os.path.getsize(filepath) if os.path.exists(filepath) else None
+        os.replace(temp_path, filepath)
+    
+    size = os.path.getsize(filepath)
+    if replaced_size is None:
+        image_index.adjust_storage_stats(LOCAL_STORAGE, 1, size)
+    else:
+        image_index.adjust_storage_stats(LOCAL_STORAGE, 0, size - replaced_size)
+    image_index.record_local_file(filename, local_content_key(filename), size)
+    return filepath
+
+def delete_local_file(filename):
+    """Delete a file from local storage, updating the storage counters
+    
+    Returns the number of bytes freed (0 if the file was already gone).
+    """
+    image_index.remove_local_file(filename)
+    filepath = image_storage.resolve_path(IMAGES_DIR, filename)
+    if not filepath:
+        return 0
+    try:
+        size = os.path.getsize(filepath)
+        os.remove(filepath)
+    except FileNotFoundError:
+        return 0
+    image_index.adjust_storage_stats(LOCAL_STORAGE, -1, -size)
+    return size
+
+def local_content_key(filename):
+    """Index content key of a local image file, or None if it must never be evicted"""
+    if filename.startswith('upload_'):
+        return None  # Direct uploads have no origin to download them from again
+    stem = os.path.splitext(filename)[0]
+    return stem if len(stem) == 64 else legacy_content_key(stem)
+
+def note_local_access(filename):
+    """Buffer a local image access; flushed to the index in the background"""
+    with local_accesses_lock:
+        local_accesses[filename] = time.time()
+
+def flush_local_accesses():
+    """Write buffered access times to the index in one transaction"""
+    global local_accesses
+    with local_accesses_lock:
+        accesses, local_accesses = local_accesses, {}
+    if accesses:
+        image_index.touch_local_files(accesses.items())
+
+def evict_local_storage():
+    """Delete local images until usage is back under the quota target
+    
+    Images already on Cloudinary are evicted first, then images that can be
+    downloaded again, least recently used first. Returns the bytes freed.
+    """
+    _, total_bytes = get_local_storage_stats()
+    if total_bytes <= LOCAL_STORAGE_QUOTA:
+        return 0
+    
+    target = LOCAL_STORAGE_QUOTA * EVICTION_TARGET_RATIO
+    freed = 0
+    evicted = 0
+    while total_bytes - freed > target:
+        candidates = image_index.eviction_candidates(100)
+        if not candidates:
+            logger.warning("⚠️ Local storage is over quota but nothing more can be evicted")
+            break
+        for candidate in candidates:
+            if total_bytes - freed <= target:
+                break
+            freed += delete_local_file(candidate['filename'])
+            if candidate['storage'] != 'cloudinary':
+                # The only copy is gone; its URL stays valid and the next request downloads it again
+                image_index.mark_evicted(candidate['content_hash'])
+            evicted += 1
+    
+    logger.info(f"🧹 Evicted {evicted} local images ({freed} bytes) to stay under the storage quota")
+    return freed
+
+def local_storage_maintenance_loop():
+    """Flush LRU access times and keep local storage under its quota"""
+    while True:
+        time.sleep(ACCESS_FLUSH_INTERVAL)
+        try:
+            flush_local_accesses()
+            if LOCAL_STORAGE_QUOTA and image_index.claim_task('local-eviction', EVICTION_INTERVAL):
+                evict_local_storage()
+        except Exception as e:
+            logger.error(f"Local storage maintenance failed: {e}")
+
+def reconcile_storage_stats():
+    """Recount local storage from disk, correcting any counter and LRU table drift"""
+    scan_started = time.time()
+    files = []
+    total_bytes = 0
+    for filename, path in image_storage.iter_stored_files(IMAGES_DIR):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue  # Removed while we were scanning
+        total_bytes += stat.st_size
+        files.append((filename, local_content_key(filename), stat.st_size, stat.st_mtime))
+    file_count = len(files)
+    image_index.set_storage_stats(LOCAL_STORAGE, file_count, total_bytes)
+    image_index.sync_local_files(files, scan_started)
+    logger.info(f"📊 Reconciled local storage: {file_count} files, {total_bytes} bytes")
+
+def storage_reconcile_loop():
+    """Periodically rescan local storage; only one worker wins each interval"""
+    while True:
+        try:
+            if image_index.claim_storage_reconcile(LOCAL_STORAGE, STATS_RECONCILE_INTERVAL):
+                reconcile_storage_stats()
+        except Exception as e:
+            logger.error(f"Storage reconcile failed: {e}")
+        time.sleep(min(STATS_RECONCILE_INTERVAL, 60))
+
+def probe_cloudinary():
+    """Ping Cloudinary once and record the result and latency"""
+    started = time.monotonic()
+    try:
+        cloudinary.api.ping(timeout=HEALTH_PROBE_TIMEOUT)
+        status = 'connected'
+    except Exception as e:
+        status = f"error: {str(e)}"
+    latency_ms = round((time.monotonic() - started) * 1000, 1)
+    
+    with cloudinary_probe_lock:
+        cloudinary_probe.update({
+            'status': status,
+            'latencyMs': latency_ms,
+            'checkedAt': datetime.now().isoformat()
+        })
+
+def cloudinary_probe_loop():
+    """Refresh the Cloudinary status snapshot every HEALTH_PROBE_INTERVAL seconds"""
+    while True:
+        probe_cloudinary()
+        time.sleep(HEALTH_PROBE_INTERVAL)
+
+def get_cloudinary_probe():
+    """Copy of the latest Cloudinary probe result"""
+    with cloudinary_probe_lock:
+        return dict(cloudinary_probe)
+
+def promote_next_image():
+    """Upload one queued local image to Cloudinary; returns False if the queue is idle"""
+    job = image_index.claim_promotion(PROMOTION_LEASE)
+    if not job:
+        return False
+    
+    content_hash = job['content_hash']
+    filepath = image_storage.resolve_path(IMAGES_DIR, job['filename'])
+    if not filepath:
+        logger.warning(f"Dropping promotion of missing local image: {job['filename']}")
+        image_index.complete_promotion(content_hash)
+        return True
+    
+    cloudinary_url = upload_to_cloudinary(filepath, content_hash)
+    if cloudinary_url:
+        # The local copy stays as a cache; the index now hands out the Cloudinary URL
+        image_index.update_content(content_hash, cloudinary_url, 'cloudinary')
+        image_index.complete_promotion(content_hash)
+        logger.info(f"☁️ Promoted {job['filename']} to Cloudinary")
+    else:
+        delay = min(PROMOTION_RETRY_BASE * (2 ** job['attempts']), PROMOTION_RETRY_MAX)
+        image_index.retry_promotion(content_hash, 'Cloudinary upload failed', delay, PROMOTION_MAX_ATTEMPTS)
+        logger.warning(f"Promotion of {job['filename']} failed (attempt {job['attempts'] + 1}), retrying in {delay}s")
+    return True
+
+def promotion_loop():
+    """Drain the durable promotion queue"""
+    while True:
+        try:
+            if not promote_next_image():
+                time.sleep(2)
+        except Exception as e:
+            logger.error(f"Promotion worker error: {e}")
+            time.sleep(5)
+
+def run_job(job):
+    """Process a claimed job's unfinished items, persisting each result as it completes"""
+    job_id = job['job_id']
+    while True:
+        items = image_index.pending_job_items(job_id, JOB_CHUNK_SIZE)
+        if not items:
+            break
+        urls = [url for _, url in items]
+        for index, item in iter_image_results(urls):
+            position = items[index][0]
+            image_index.record_job_item(job_id, position, item['result'], item['error'], JOB_LEASE)
+    image_index.finish_job(job_id)
+    finished = image_index.get_job(job_id)
+    logger.info(f"🧾 Job {job_id} completed: {finished['processed'] - finished['failed']} processed, {finished['failed']} failed")
+
+def job_loop():
+    """Run queued batch jobs, resuming any abandoned by a dead worker"""
+    next_purge = 0
+    while True:
+        try:
+            job = image_index.claim_job(JOB_LEASE)
+            if job:
+                run_job(job)
+                continue
+            if time.time() >= next_purge:
+                image_index.purge_jobs(time.time() - JOB_RETENTION)
+                next_purge = time.time() + 3600
+        except Exception as e:
+            logger.error(f"Job runner error: {e}")
+        job_wakeup.wait(2)
+        job_wakeup.clear()
+
+def metrics_publish_loop():
+    """Publish this worker's metrics snapshot for /metrics in other workers"""
+    while True:
+        try:
+            metrics.publish_snapshot(metrics_registry, METRICS_DIR)
+        except Exception as e:
+            logger.error(f"Metrics publish failed: {e}")
+        time.sleep(METRICS_PUBLISH_INTERVAL)
+
+def start_background_tasks():
+    """Start this process's background threads, once per process"""
+    global background_tasks_pid
+    # Threads don't survive fork, so each gunicorn worker starts its own
+    if background_tasks_pid == os.getpid():
+        return
+    with background_tasks_lock:
+        if background_tasks_pid == os.getpid():
+            return
+        background_tasks_pid = os.getpid()
+        threading.Thread(target=storage_reconcile_loop, name='storage-reconcile', daemon=True).start()
+        threading.Thread(target=local_storage_maintenance_loop, name='local-storage-maintenance', daemon=True).start()
+        threading.Thread(target=metrics_publish_loop, name='metrics-publish', daemon=True).start()
+        if CLOUDINARY_ENABLED:
+            threading.Thread(target=cloudinary_probe_loop, name='cloudinary-probe', daemon=True).start()
+        if CLOUDINARY_ENABLED and WRITE_BEHIND_ENABLED:
+            for i in range(PROMOTION_WORKERS):
+                threading.Thread(target=promotion_loop, name=f'promotion-{i}', daemon=True).start()
+        for i in range(JOB_WORKERS):
+            threading.Thread(target=job_loop, name=f'job-runner-{i}', daemon=True).start()
+
+@app.before_request
+def ensure_background_tasks():
+    """Make sure background threads run in this worker"""
+    start_background_tasks()
+
+@app.before_request
+def start_request_timer():
+    """Note when the request started, for the request duration metric"""
+    g.request_started = time.perf_counter()
+    g.counted_in_flight = True
+    in_flight.inc(stage='http')
+
+@app.after_request
+def record_request_metrics(response):
+    """Record request duration and response size"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        http_request_seconds.observe(time.perf_counter() - started, endpoint=endpoint,
+                                     method=request.method, status=str(response.status_code))
+        if response.content_length:
+            http_response_bytes.inc(response.content_length, endpoint=endpoint)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    """Stop counting the request as in flight, even if it failed"""
+    if g.pop('counted_in_flight', False):
+        in_flight.dec(stage='http')
+
+def get_local_storage_stats():
+    """Local storage file count and size from the counters (O(1))"""
+    stats = image_index.get_storage_stats(LOCAL_STORAGE) or {'file_count': 0, 'total_bytes': 0}
+    return stats['file_count'], stats['total_bytes']
+
+def validate_index_entry(entry):
+    """Return the entry's stored URL, dropping the entry if its local file is gone"""
+    if entry['storage'] == 'evicted':
+        return None  # Downloaded again, keeping its aliases
+    if entry['storage'] == 'local':
+        # Local copies can disappear (redeploys wipe the disk), so verify the file
+        filename = entry['stored_url'].rsplit('/', 1)[-1]
+        if not image_storage.resolve_path(IMAGES_DIR, filename):
+            image_index.remove_content(entry['content_hash'])
+            return None
+    
+    return entry['stored_url']
+
+def lookup_indexed_image(url):
+    """Return the stored URL for an already processed image URL, or None"""
+    entry = image_index.lookup(url)
+    return validate_index_entry(entry) if entry else None
+
+def lookup_indexed_content(content_hash):
+    """Return the stored URL for already stored image bytes, or None"""
+    entry = image_index.lookup_content(content_hash)
+    return validate_index_entry(entry) if entry else None
 
 @app.route('/')
 def home():
@@ -170,14 +799,25 @@ def home():
             'cloudinary_storage': CLOUDINARY_ENABLED,
             'local_fallback': True,
             'auto_optimization': CLOUDINARY_ENABLED,
-            'persistent_storage': CLOUDINARY_ENABLED
+            'persistent_storage': CLOUDINARY_ENABLED,
+            'write_behind': CLOUDINARY_ENABLED and WRITE_BEHIND_ENABLED
         },
         'endpoints': {
             'process_images': 'POST /api/process-images - Process image URLs',
             'upload_image': 'POST /api/upload-image - Direct file upload',
             'serve_image': 'GET /api/images/<filename> - Serve local images',
             'health_check': 'GET /api/health - Health status',
-            'stats': 'GET /api/stats - Server statistics'
+            'liveness': 'GET /api/health/live - Liveness probe',
+            'readiness': 'GET /api/health/ready - Readiness probe',
+            'submit_job': 'POST /api/process-images/jobs - Process image URLs in the background',
+            'job_status': 'GET /api/process-images/jobs/<job_id> - Job progress',
+            'job_events': 'GET /api/process-images/jobs/<job_id>/events - Job progress as server-sent events (threaded workers only)',
+            'job_result': 'GET /api/process-images/jobs/<job_id>/result - URL mapping so far',
+            'stats': 'GET /api/stats - Server statistics',
+            'exam_bundle': 'GET /api/exams/<exam>/bundle - All images of an exam as one tar (Range supported)',
+            'exam_bundle_manifest': 'GET /api/exams/<exam>/bundle/manifest - Bundle manifest',
+            'metrics': 'GET /metrics - Prometheus metrics',
+            'negative_cache': 'GET/DELETE /api/admin/negative-cache - List or purge failed URLs (admin token)'
         },
         'storage': {
             'primary': 'Cloudinary' if CLOUDINARY_ENABLED else 'Local',
@@ -186,67 +826,268 @@ def home():
         'timestamp': datetime.now().isoformat()
     })
 
+def get_host_semaphore(url):
+    """Get the semaphore limiting concurrent downloads from the URL's host"""
+    host = urlparse(url).netloc.lower()
+    with host_semaphores_lock:
+        semaphore = host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(PER_HOST_LIMIT)
+            host_semaphores[host] = semaphore
+        return semaphore
+
+def is_already_processed_url(url):
+    """Check if a URL already points at our own server or Cloudinary"""
+    return any(domain in url for domain in SKIP_DOMAINS)
+
+def resolve_existing_cloudinary_images(image_urls):
+    """Check Cloudinary for already uploaded images in batched Admin API calls
+    
+    Images found are recorded in the index. Returns the set of URLs whose
+    existence was checked, so callers can skip per-image lookups for them.
+    """
+    if not CLOUDINARY_ENABLED:
+        return set()
+    
+    urls_by_public_id = {}
+    for url in image_urls:
+        if is_already_processed_url(url) or image_index.lookup(url):
+            continue
+        # Only images stored before content addressing can be found by URL
+        public_id = f"{CLOUDINARY_FOLDER}/{generate_filename(url).split('.')[0]}"
+        urls_by_public_id.setdefault(public_id, []).append(url)
+    
+    checked_urls = set()
+    public_ids = list(urls_by_public_id)
+    for start in range(0, len(public_ids), CLOUDINARY_LOOKUP_BATCH_SIZE):
+        chunk = public_ids[start:start + CLOUDINARY_LOOKUP_BATCH_SIZE]
+        try:
+            with stage_seconds.time(stage='cloudinary_batch_lookup'):
+                result = cloudinary.api.resources_by_ids(chunk, max_results=len(chunk))
+        except Exception as e:
+            logger.warning(f"Batch Cloudinary lookup failed, falling back to per-image checks: {e}")
+            continue
+        
+        found = 0
+        for resource in result.get('resources', []):
+            secure_url = resource.get('secure_url')
+            if not secure_url:
+                continue
+            legacy_key = legacy_content_key(resource.get('public_id', '').rsplit('/', 1)[-1])
+            for url in urls_by_public_id.get(resource.get('public_id'), []):
+                image_index.record(url, legacy_key, secure_url, 'cloudinary', resource.get('bytes'))
+                found += 1
+        logger.info(f"☁️ Batch Cloudinary lookup: {found} of {len(chunk)} images already uploaded")
+        
+        chunk_urls = sum(len(urls_by_public_id[public_id]) for public_id in chunk)
+        cache_lookups.inc(found, cache='cloudinary', result='hit')
+        cache_lookups.inc(chunk_urls - found, cache='cloudinary', result='miss')
+        for public_id in chunk:
+            checked_urls.update(urls_by_public_id[public_id])
+    
+    return checked_urls
+
+def process_single_image(url, check_cloudinary=True):
+    """Resolve one image URL to a stored URL, downloading and saving it if needed
+    
+    Pass check_cloudinary=False when the batch lookup already covered this URL.
+    Concurrent calls for the same URL (e.g. several clients importing the same
+    exam) wait for a single fetch and share its result.
+    """
+    with in_flight.track_in_progress(stage='process'), process_seconds.time() as timer:
+        # Skip if URL is already from our own server or Cloudinary (prevents circular reference)
+        if is_already_processed_url(url):
+            logger.warning(f"Skipping already processed URL to prevent circular reference: {url}")
+            timer['outcome'] = 'skipped'
+            return url  # Return the URL as-is
+        
+        (stored_url, outcome), shared = url_flights.do(url, resolve_image_url, url, check_cloudinary)
+        if shared:
+            logger.info(f"🔗 Shared in-flight result for: {url}")
+        timer['outcome'] = 'shared' if shared else outcome
+        return stored_url
+
+def resolve_image_url(url, check_cloudinary):
+    """Look up or fetch one image URL; called once per URL at a time
+    
+    Returns (stored_url, outcome), outcome naming where the image was found.
+    """
+    # Check the local index first - no network round-trip for known images
+    with stage_seconds.time(stage='index_lookup'):
+        indexed_url = lookup_indexed_image(url)
+    cache_lookups.inc(cache='index', result='hit' if indexed_url else 'miss')
+    if indexed_url:
+        logger.info(f"Image found in index: {url}")
+        return indexed_url, 'index_hit'
+    
+    # Don't retry an origin that failed recently until its backoff window ends
+    failure = negative_cache.lookup(url)
+    backing_off = negative_cache.is_backing_off(failure)
+    cache_lookups.inc(cache='negative', result='hit' if backing_off else 'miss')
+    if backing_off:
+        retry_in = int(failure['retry_at'] - time.time()) + 1
+        raise RecentlyFailedError(
+            f"Recently failed ({failure['failure_class']}), retrying after {retry_in}s: {failure['error']}")
+    
+    # Images stored before content addressing are keyed by URL hash
+    filename = generate_filename(url)
+    filepath = image_storage.resolve_path(IMAGES_DIR, filename)
+    public_id = filename.split('.')[0]  # For Cloudinary
+    legacy_key = legacy_content_key(public_id)
+    
+    # Check if we already have this image in Cloudinary or locally
+    if CLOUDINARY_ENABLED and check_cloudinary:
+        existing_resource = None
+        with stage_seconds.time(stage='cloudinary_lookup') as timer:
+            try:
+                # Check if image exists in Cloudinary
+                existing_resource = cloudinary.api.resource(f"{CLOUDINARY_FOLDER}/{public_id}")
+            except cloudinary.exceptions.NotFound:
+                # Image doesn't exist in Cloudinary, continue with processing
+                pass
+            except Exception as e:
+                timer['outcome'] = 'error'
+                logger.debug(f"Could not check Cloudinary for existing image: {e}")
+        
+        found = bool(existing_resource and existing_resource.get('secure_url'))
+        cache_lookups.inc(cache='cloudinary', result='hit' if found else 'miss')
+        if found:
+            logger.info(f"Image already exists in Cloudinary: {public_id}")
+            image_index.record(url, legacy_key, existing_resource['secure_url'], 'cloudinary',
+                               existing_resource.get('bytes'))
+            return existing_resource['secure_url'], 'cloudinary_hit'
+    
+    # Check local fallback if Cloudinary check failed
+    cache_lookups.inc(cache='local', result='hit' if filepath else 'miss')
+    if filepath:
+        logger.info(f"Image already exists locally: {filename}")
+        local_url = f"/api/images/{filename}"
+        image_index.record(url, legacy_key, local_url, 'local', os.path.getsize(filepath))
+        return local_url, 'local_hit'
+    
+    # Download image, limiting how hard we hit any single origin
+    logger.info(f"📥 Downloading image: {url}")
+    with get_host_semaphore(url):
+        with in_flight.track_in_progress(stage='download'), stage_seconds.time(stage='download'):
+            try:
+                temp_path, content_hash, size = download_image(url)
+            except Exception as e:
+                failure_class = classify_download_failure(e)
+                if failure_class:
+                    entry = negative_cache.record_failure(url, failure_class, str(e))
+                    backoff = int(entry['retry_at'] - entry['failed_at'])
+                    logger.warning(f"🚫 Backing off {url} for {backoff}s after {entry['failures']} failure(s)")
+                raise
+    if failure:
+        negative_cache.clear(url)  # Recovered since its last failure
+    download_bytes.inc(size)
+    
+    # Save image (Cloudinary with local fallback)
+    saved_url = save_image_with_cloudinary_fallback(url, temp_path, content_hash, size)
+    
+    logger.info(f"✅ Successfully processed: {saved_url}")
+    return saved_url, 'stored'
+
+def iter_image_results(image_urls):
+    """Process image URLs concurrently, yielding (index, result) as each one finishes
+    
+    Each result is a dict with 'url', 'result' (stored URL or None) and 'error'.
+    Duplicate URLs within a batch are only processed once, and yielded once
+    per index they appear at.
+    """
+    positions = {}
+    for index, url in enumerate(image_urls):
+        positions.setdefault(url, []).append(index)
+    
+    # Resolve index misses against Cloudinary in a few batched calls up front
+    checked_urls = resolve_existing_cloudinary_images(list(positions))
+    
+    futures = {}
+    for url in positions:
+        futures[image_executor.submit(process_single_image, url, url not in checked_urls)] = url
+    
+    for future in as_completed(futures):
+        url = futures[future]
+        try:
+            item = {'url': url, 'result': future.result(), 'error': None}
+        except Exception as e:
+            item = {'url': url, 'result': None, 'error': str(e)}
+        for index in positions[url]:
+            yield index, item
+
+def process_image_batch(image_urls):
+    """Process image URLs concurrently, returning one result per URL in input order"""
+    results = [None] * len(image_urls)
+    for index, item in iter_image_results(image_urls):
+        results[index] = item
+    return results
+
+def storage_tier(stored_url):
+    """Where a resolved image URL is served from"""
+    if stored_url.startswith('/api/images/'):
+        return 'local'
+    if 'cloudinary.com' in stored_url:
+        return 'cloudinary'
+    return 'external'  # Passed through unchanged (already processed elsewhere)
+
+def wants_ndjson_stream():
+    """Whether the client opted in to a streamed NDJSON response"""
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return request.accept_mimetypes.best == 'application/x-ndjson'
+
+def stream_image_results(image_urls):
+    """Yield one NDJSON line per URL as it resolves, then a summary line"""
+    processed = 0
+    errors = 0
+    for index, item in iter_image_results(image_urls):
+        if item['error'] is None:
+            processed += 1
+            storage = storage_tier(item['result'])
+        else:
+            errors += 1
+            storage = None
+            logger.error(f"Failed to process {item['url']}: {item['error']}")
+        yield json.dumps({
+            'index': index,
+            'url': item['url'],
+            'result': item['result'],
+            'error': item['error'],
+            'storage': storage
+        }) + '\n'
+    yield json.dumps({'done': True, 'totalProcessed': processed, 'totalErrors': errors}) + '\n'
+
 @app.route('/api/process-images', methods=['POST'])
 def process_images():
-    """Process multiple image URLs and return local URLs"""
+    """Process multiple image URLs and return local URLs
+    
+    Send ?stream=1 or Accept: application/x-ndjson to get one JSON line per
+    URL as soon as it resolves instead of a single response at the end.
+    """
     try:
         data = request.get_json()
         if not data or 'imageUrls' not in data:
             return jsonify({'error': 'Missing imageUrls in request'}), 400
         
         image_urls = data['imageUrls']
-        if not isinstance(image_urls, list):
-            return jsonify({'error': 'imageUrls must be a list'}), 400
+        # Checked up front: a non-string item would break batch deduplication for every URL
+        if not isinstance(image_urls, list) or not all(isinstance(url, str) for url in image_urls):
+            return jsonify({'error': 'imageUrls must be a list of strings'}), 400
+        
+        if wants_ndjson_stream():
+            return Response(stream_image_results(image_urls), mimetype='application/x-ndjson', headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'  # Don't let nginx buffer the stream
+            })
         
         processed_images = []
         errors = []
         
-        for url in image_urls:
-            try:
-                # Skip if URL is already from our own server or Cloudinary (prevents circular reference)
-                if any(domain in url for domain in ['image-processing-server', 'onrender.com', 'cloudinary.com']):
-                    logger.warning(f"Skipping already processed URL to prevent circular reference: {url}")
-                    processed_images.append(url)  # Return the URL as-is
-                    continue
-                
-                # Generate filename for local fallback check
-                filename = generate_filename(url)
-                filepath = os.path.join(IMAGES_DIR, filename)
-                public_id = filename.split('.')[0]  # For Cloudinary
-                
-                # Check if we already have this image in Cloudinary or locally
-                if CLOUDINARY_ENABLED:
-                    try:
-                        # Check if image exists in Cloudinary
-                        existing_resource = cloudinary.api.resource(f"examtopic_images/{public_id}")
-                        if existing_resource and existing_resource.get('secure_url'):
-                            logger.info(f"Image already exists in Cloudinary: {public_id}")
-                            processed_images.append(existing_resource['secure_url'])
-                            continue
-                    except cloudinary.exceptions.NotFound:
-                        # Image doesn't exist in Cloudinary, continue with processing
-                        pass
-                    except Exception as e:
-                        logger.debug(f"Could not check Cloudinary for existing image: {e}")
-                
-                # Check local fallback if Cloudinary check failed
-                if os.path.exists(filepath):
-                    logger.info(f"Image already exists locally: {filename}")
-                    processed_images.append(f"/api/images/{filename}")
-                    continue
-                
-                # Download image
-                logger.info(f"📥 Downloading image: {url}")
-                image_data = download_image(url)
-                
-                # Save image (Cloudinary with local fallback)
-                saved_url = save_image_with_cloudinary_fallback(url, image_data)
-                
-                logger.info(f"✅ Successfully processed: {saved_url}")
-                processed_images.append(saved_url)
-                
-            except Exception as e:
-                error_msg = f"Failed to process {url}: {str(e)}"
+        for item in process_image_batch(image_urls):
+            if item['error'] is None:
+                processed_images.append(item['result'])
+            else:
+                error_msg = f"Failed to process {item['url']}: {item['error']}"
                 logger.error(error_msg)
                 errors.append(error_msg)
         
@@ -262,29 +1103,326 @@ def process_images():
         logger.error(f"Error processing images: {e}")
         return jsonify({'error': str(e)}), 500
 
+def job_summary(job):
+    """Public view of a job's status and progress"""
+    return {
+        'jobId': job['job_id'],
+        'status': job['status'],
+        'total': job['total'],
+        'processed': job['processed'],
+        'failed': job['failed'],
+        'createdAt': datetime.fromtimestamp(job['created_at']).isoformat(),
+        'updatedAt': datetime.fromtimestamp(job['updated_at']).isoformat()
+    }
+
+@app.route('/api/process-images/jobs', methods=['POST'])
+def submit_image_job():
+    """Queue image URLs for background processing and return a job id"""
+    try:
+        data = request.get_json()
+        if not data or 'imageUrls' not in data:
+            return jsonify({'error': 'Missing imageUrls in request'}), 400
+        
+        image_urls = data['imageUrls']
+        if not isinstance(image_urls, list) or not all(isinstance(url, str) for url in image_urls):
+            return jsonify({'error': 'imageUrls must be a list of strings'}), 400
+        if len(image_urls) > JOB_MAX_URLS:
+            return jsonify({'error': f'Too many imageUrls (max {JOB_MAX_URLS} per job)'}), 400
+        
+        job_id = uuid.uuid4().hex
+        image_index.create_job(job_id, image_urls)
+        job_wakeup.set()
+        logger.info(f"🧾 Queued job {job_id} with {len(image_urls)} images")
+        
+        response = {
+            'success': True,
+            **job_summary(image_index.get_job(job_id)),
+            'statusUrl': f'/api/process-images/jobs/{job_id}',
+            'resultUrl': f'/api/process-images/jobs/{job_id}/result'
+        }
+        if job_events_supported():
+            response['eventsUrl'] = f'/api/process-images/jobs/{job_id}/events'
+        return jsonify(response), 202
+        
+    except Exception as e:
+        logger.error(f"Error queueing image job: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/process-images/jobs/<job_id>')
+def get_image_job(job_id):
+    """Get a job's status and progress"""
+    job = image_index.get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_summary(job))
+
+def job_events_supported():
+    """Whether this worker can hold event streams open without starving other requests"""
+    return bool(request.environ.get('wsgi.multithread'))
+
+@app.route('/api/process-images/jobs/<job_id>/events')
+def stream_image_job(job_id):
+    """Stream a job's progress as server-sent events
+    
+    Sends a 'progress' event whenever the counters change and a 'complete'
+    event at the end. Connections are closed after JOB_STREAM_DURATION;
+    EventSource clients reconnect automatically. Only served by threaded
+    workers: a stream would keep a sync worker busy almost continuously.
+    """
+    if not job_events_supported():
+        return jsonify({'error': 'Job event streams need threaded workers (GUNICORN_WORKER_CLASS=gthread); '
+                                 'poll the job status URL instead'}), 501
+    if not image_index.get_job(job_id):
+        return jsonify({'error': 'Job not found'}), 404
+    
+    def generate():
+        deadline = time.monotonic() + JOB_STREAM_DURATION
+        last_sent = None
+        yield 'retry: 1000\n\n'
+        while True:
+            summary = job_summary(image_index.get_job(job_id))
+            if summary['status'] == 'completed':
+                yield f"event: complete\ndata: {json.dumps(summary)}\n\n"
+                return
+            progress = (summary['status'], summary['processed'])
+            if progress != last_sent:
+                yield f"event: progress\ndata: {json.dumps(summary)}\n\n"
+                last_sent = progress
+            if time.monotonic() >= deadline:
+                return
+            time.sleep(1)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Don't let nginx buffer the stream
+    })
+
+@app.route('/api/process-images/jobs/<job_id>/result')
+def get_image_job_result(job_id):
+    """Get the URL mapping of a job's finished items (partial while it runs)"""
+    job = image_index.get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    mapping = {}
+    errors = {}
+    for item in image_index.job_items(job_id):
+        if item['error'] is None:
+            mapping[item['url']] = item['result']
+        else:
+            errors[item['url']] = item['error']
+    
+    return jsonify({
+        **job_summary(job),
+        'complete': job['status'] == 'completed',
+        'mapping': mapping,
+        'errors': errors
+    })
+
+def send_local_image(directory, filename):
+    """Send a locally stored image with long-lived caching headers
+    
+    Filenames are content or URL hashes and are never rewritten, so the name
+    is a strong ETag and the response can be cached as immutable. Conditional
+    requests (If-None-Match / If-Modified-Since) get 304 Not Modified and
+    Range requests get 206 Partial Content. The bytes are handed to the
+    server or front proxy according to IMAGE_SEND_MODE.
+    """
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    etag = os.path.splitext(filename)[0]
+    
+    # Files live in hash shards (or flat, before migration)
+    relative_path = image_storage.resolve_relative_path(os.path.join(app.root_path, directory), filename)
+    if relative_path is None:
+        raise NotFound()
+    
+    if IMAGE_SEND_MODE == 'x-accel-redirect':
+        filepath = os.path.join(app.root_path, directory, relative_path)
+        
+        # nginx serves the body (and Range requests) from its internal location;
+        # paths are relative to the store, which may live outside the app directory
+        response = app.response_class(mimetype=mimetype)
+        response.set_etag(etag)
+        response.last_modified = os.path.getmtime(filepath)
+        response.make_conditional(request)
+        if response.status_code != 304:
+            location = ACCEL_LOCATIONS[directory]
+            response.headers['X-Accel-Redirect'] = f"{IMAGE_ACCEL_PREFIX}/{location}/{relative_path.replace(os.sep, '/')}"
+    else:
+        # send_file uses wsgi.file_wrapper (zero-copy sendfile under gunicorn)
+        # or X-Sendfile when USE_X_SENDFILE is set
+        response = send_from_directory(directory, relative_path, mimetype=mimetype, etag=etag,
+                                       max_age=IMAGE_CACHE_MAX_AGE)
+    
+    response.headers['Cache-Control'] = f"public, max-age={IMAGE_CACHE_MAX_AGE}, immutable"
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+def parse_variant_params(filename, args, accept):
+    """Validate variant query parameters
+    
+    Returns a dict with width, height, format and quality, or None when no
+    variant was requested. Raises ValueError for invalid parameters.
+    
+    Width and height round up to the next of VARIANT_SIZES and quality to the
+    nearest of VARIANT_QUALITIES, so clients can't fill the variant cache with
+    arbitrary combinations.
+    """
+    if not any(key in args for key in ('w', 'h', 'fmt', 'q')):
+        return None
+    
+    params = {}
+    for key, name in (('w', 'width'), ('h', 'height')):
+        value = args.get(key)
+        if value is None:
+            params[name] = None
+            continue
+        if not value.isdigit() or not 0 < int(value) <= MAX_VARIANT_DIMENSION:
+            raise ValueError(f"{key} must be an integer between 1 and {MAX_VARIANT_DIMENSION}")
+        params[name] = next((size for size in VARIANT_SIZES if size >= int(value)), VARIANT_SIZES[-1])
+    
+    quality = args.get('q', str(DEFAULT_VARIANT_QUALITY))
+    if not quality.isdigit() or not 1 <= int(quality) <= 100:
+        raise ValueError("q must be an integer between 1 and 100")
+    params['quality'] = min(VARIANT_QUALITIES, key=lambda level: abs(level - int(quality)))
+    
+    fmt = args.get('fmt', 'auto').lower()
+    if fmt == 'jpg':
+        fmt = 'jpeg'
+    if fmt == 'auto':
+        # Prefer WebP when the client accepts it, otherwise keep the source format
+        source_ext = os.path.splitext(filename)[1].lower().lstrip('.')
+        source_fmt = 'jpeg' if source_ext in ('jpg', 'jpeg') else 'png'
+        fmt = 'webp' if 'image/webp' in accept else source_fmt
+    elif fmt not in VARIANT_FORMATS:
+        raise ValueError(f"fmt must be one of: auto, {', '.join(VARIANT_FORMATS)}")
+    params['format'] = fmt
+    
+    return params
+
+def variant_filename(filename, params):
+    """Deterministic cache filename for a variant of a stored image"""
+    stem = os.path.splitext(filename)[0]
+    width = params['width'] or 0
+    height = params['height'] or 0
+    # The format is part of the stem too, since the stem doubles as the ETag
+    return f"{stem}_w{width}_h{height}_q{params['quality']}_{params['format']}.{params['format']}"
+
+class VariantSourceTooLargeError(ValueError):
+    """Raised when an image has more than MAX_VARIANT_SOURCE_PIXELS pixels to decode"""
+
+def open_variant_source(source_path):
+    """Open an image for resizing, refusing decompression bombs before decoding"""
+    try:
+        return Image.open(source_path)
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning) as e:
+        raise VariantSourceTooLargeError(str(e)) from e
+
+def generate_variant(source_path, variant_path, params):
+    """Resize and transcode an image into the variant cache"""
+    with open_variant_source(source_path) as img:
+        # Fit inside the requested box, keeping aspect ratio and never upscaling
+        width = params['width'] or img.width
+        height = params['height'] or img.height
+        img.thumbnail((width, height))
+        
+        if params['format'] == 'jpeg' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        elif img.mode == 'P':
+            img = img.convert('RGBA')
+        
+        # Write to a temp file and rename so readers never see a partial variant
+        fd, temp_path = tempfile.mkstemp(dir=VARIANTS_DIR, prefix='.variant-', suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                img.save(f, VARIANT_FORMATS[params['format']], quality=params['quality'], optimize=True)
+            os.replace(temp_path, variant_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+def ensure_variant(source_path, variant_name, params):
+    """Generate a variant unless another request finished it first"""
+    if image_storage.resolve_path(VARIANTS_DIR, variant_name):
+        return
+    logger.info(f"🖼️ Generating variant: {variant_name}")
+    with stage_seconds.time(stage='variant_render'):
+        generate_variant(source_path, image_storage.prepare_path(VARIANTS_DIR, variant_name), params)
+
+def send_image(filename, params):
+    """Send a local image or its variant; raises NotFound if the image is not on disk"""
+    if params is None or not PIL_AVAILABLE:
+        return send_local_image(IMAGES_DIR, filename)
+    
+    source_path = image_storage.resolve_path(IMAGES_DIR, filename)
+    if source_path is None:
+        raise NotFound()
+    
+    variant_name = variant_filename(filename, params)
+    variant_exists = image_storage.resolve_path(VARIANTS_DIR, variant_name) is not None
+    cache_lookups.inc(cache='variant', result='hit' if variant_exists else 'miss')
+    if not variant_exists:
+        variant_flights.do(variant_name, ensure_variant, source_path, variant_name, params)
+    
+    response = send_local_image(VARIANTS_DIR, variant_name)
+    if request.args.get('fmt', 'auto').lower() == 'auto':
+        response.vary.add('Accept')
+    return response
+
+def locate_missing_image(filename):
+    """Stored URL of a local image whose file is not on disk, or None
+    
+    The local copy of a promoted image may have been evicted; Cloudinary
+    still has it. An evicted local-only image is downloaded again from its
+    origin, usually back to the same URL.
+    """
+    content_key = local_content_key(filename)
+    entry = image_index.lookup_content(content_key) if content_key else None
+    if entry and entry['storage'] == 'cloudinary':
+        return entry['stored_url']
+    if entry and entry['storage'] == 'evicted':
+        for url in image_index.origin_urls(content_key):
+            try:
+                return process_single_image(url)
+            except Exception as e:
+                logger.warning(f"Could not download evicted image {filename} again from {url}: {e}")
+    return None
+
 @app.route('/api/images/<filename>')
 def serve_image(filename):
-    """Serve processed images"""
+    """Serve processed images, optionally resized/transcoded (?w=480&fmt=webp)"""
+    try:
+        params = parse_variant_params(filename, request.args, request.headers.get('Accept', ''))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     try:
-        return send_from_directory(IMAGES_DIR, filename)
+        note_local_access(filename)
+        try:
+            return send_image(filename, params)
+        except NotFound:
+            stored_url = locate_missing_image(filename)
+            if stored_url is None:
+                raise
+            if stored_url != f"/api/images/{filename}":
+                return redirect(stored_url, 302)
+            return send_image(filename, params)
+    except VariantSourceTooLargeError as e:
+        logger.warning(f"Refusing to resize {filename}: {e}")
+        return jsonify({'error': f'Image too large to resize. Max pixels: {MAX_VARIANT_SOURCE_PIXELS}'}), 422
+    except NotFound:
+        return jsonify({'error': 'Image not found'}), 404
     except Exception as e:
         logger.error(f"Error serving image {filename}: {e}")
         return jsonify({'error': 'Image not found'}), 404
 
 @app.route('/api/health')
 def health_check():
-    """Health check endpoint for Render"""
-    local_images_count = len(os.listdir(IMAGES_DIR)) if os.path.exists(IMAGES_DIR) else 0
+    """Health check endpoint for Render
     
-    # Check Cloudinary status
-    cloudinary_status = "disabled"
-    if CLOUDINARY_ENABLED:
-        try:
-            # Test Cloudinary connection
-            cloudinary.api.ping()
-            cloudinary_status = "connected"
-        except Exception as e:
-            cloudinary_status = f"error: {str(e)}"
+    Returns the cached background probe result, so it never waits on Cloudinary.
+    """
+    local_images_count, _ = get_local_storage_stats()
     
     return jsonify({
         'status': 'healthy',
@@ -292,29 +1430,71 @@ def health_check():
         'imagesCount': local_images_count,
         'cloudinary': {
             'enabled': CLOUDINARY_ENABLED,
-            'status': cloudinary_status
+            **get_cloudinary_probe()
         },
         'server': 'image-processing-server-with-cloudinary'
     })
 
+@app.route('/api/health/live')
+def liveness_check():
+    """Liveness probe - the worker is up and serving requests"""
+    return jsonify({'status': 'alive', 'timestamp': datetime.now().isoformat()})
+
+@app.route('/api/health/ready')
+def readiness_check():
+    """Readiness probe - local storage and the index are usable
+    
+    Cloudinary problems only degrade the service, since images fall back to
+    local storage, so they are reported without failing readiness.
+    """
+    checks = {}
+    try:
+        get_local_storage_stats()
+        checks['index'] = 'ok'
+    except Exception as e:
+        checks['index'] = f"error: {str(e)}"
+    checks['localStorage'] = 'ok' if os.access(IMAGES_DIR, os.W_OK) else 'error: not writable'
+    
+    probe = get_cloudinary_probe()
+    ready = all(result == 'ok' for result in checks.values())
+    if not ready:
+        status = 'not_ready'
+    elif CLOUDINARY_ENABLED and probe['status'] != 'connected':
+        status = 'degraded'
+    else:
+        status = 'ready'
+    
+    return jsonify({
+        'status': status,
+        'timestamp': datetime.now().isoformat(),
+        'checks': checks,
+        'cloudinary': {
+            'enabled': CLOUDINARY_ENABLED,
+            **probe
+        }
+    }), 200 if ready else 503
+
 @app.route('/api/stats')
 def get_stats():
     """Get server statistics"""
     try:
         # Local storage stats
-        image_files = os.listdir(IMAGES_DIR) if os.path.exists(IMAGES_DIR) else []
-        total_size = sum(os.path.getsize(os.path.join(IMAGES_DIR, f)) for f in image_files)
+        total_images, total_size = get_local_storage_stats()
         
         stats = {
             'localStorage': {
-                'totalImages': len(image_files),
+                'totalImages': total_images,
                 'totalSizeBytes': total_size,
-                'totalSizeMB': round(total_size / (1024 * 1024), 2)
+                'totalSizeMB': round(total_size / (1024 * 1024), 2),
+                'quotaBytes': LOCAL_STORAGE_QUOTA or None,
+                'quotaUsedPercent': round(100 * total_size / LOCAL_STORAGE_QUOTA, 1) if LOCAL_STORAGE_QUOTA else None,
+                'promotedBytes': image_index.promoted_local_bytes()
             },
             'cloudinary': {
                 'enabled': CLOUDINARY_ENABLED,
                 'status': 'disabled'
             },
+            'promotionQueue': image_index.promotion_counts(),
             'serverTime': datetime.now().isoformat()
         }
         
@@ -336,14 +1516,216 @@ def get_stats():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def exam_csv_path(exam):
+    """Path of an exam's CSV in EXAM_CSV_DIR, or None"""
+    if os.path.basename(exam) != exam or exam.startswith('.'):
+        return None
+    path = os.path.join(EXAM_CSV_DIR, f"{exam}.csv")
+    return path if os.path.isfile(path) else None
+
+def bundle_source(stored_url):
+    """(path, is_temp) of a file holding a stored image's bytes
+    
+    Local images are packed in place; Cloudinary (or other remote) images are
+    downloaded to a temp file the caller removes.
+    """
+    if stored_url.startswith('/api/images/'):
+        return image_storage.resolve_path(IMAGES_DIR, stored_url.rsplit('/', 1)[-1]), False
+    temp_path, _, _ = download_image(stored_url)
+    return temp_path, True
+
+def build_exam_bundle(exam, csv_path, directory=BUNDLES_DIR):
+    """Package every image an exam CSV references into its bundle; returns the manifest
+    
+    Images not stored yet are fetched through the batch pipeline first.
+    """
+    stored_urls = {}
+    fetch_urls = []
+    for reference in dict.fromkeys(iter_csv_image_references(csv_path)):
+        path = urlparse(reference).path
+        if path.startswith('/api/images/'):
+            stored_urls[reference] = path  # Already rewritten to our own URL
+        else:
+            fetch_urls.append(reference)
+    
+    missing = {}
+    for _, item in iter_image_results(fetch_urls):
+        if item['error'] is None:
+            stored_urls[item['url']] = item['result']
+        else:
+            missing[item['url']] = item['error']
+    
+    members = {}
+    member_names = set()
+    try:
+        for url, stored_url in stored_urls.items():
+            if stored_url not in members:
+                try:
+                    path, is_temp = bundle_source(stored_url)
+                except Exception as e:
+                    missing[url] = str(e)
+                    continue
+                if not path:
+                    missing[url] = 'Stored image file is missing'
+                    continue
+                name = os.path.basename(urlparse(stored_url).path)
+                member = f"images/{name}"
+                if member in member_names:
+                    member = f"images/{len(member_names)}_{name}"
+                member_names.add(member)
+                members[stored_url] = {'member': member, 'path': path, 'temp': is_temp, 'urls': []}
+            members[stored_url]['urls'].append(url)
+        
+        manifest = image_bundle.write_bundle(directory, exam, list(members.values()), missing)
+    finally:
+        for entry in members.values():
+            if entry['temp'] and os.path.exists(entry['path']):
+                os.remove(entry['path'])
+    
+    logger.info(f"📦 Built bundle for {exam}: {manifest['imageCount']} images, {len(missing)} missing")
+    return manifest
+
+def start_bundle_build(exam, csv_path):
+    """Build an exam's bundle in the background, unless this process already is"""
+    with bundle_builds_lock:
+        if exam in bundle_builds:
+            return
+        bundle_builds.add(exam)
+    
+    def build():
+        try:
+            build_exam_bundle(exam, csv_path)
+        except Exception as e:
+            logger.error(f"Bundle build failed for {exam}: {e}")
+        finally:
+            with bundle_builds_lock:
+                bundle_builds.discard(exam)
+    
+    threading.Thread(target=build, name=f'bundle-{exam}', daemon=True).start()
+
+def load_exam_bundle(exam):
+    """Manifest of an exam's bundle, starting a rebuild when it is missing or older than the CSV
+    
+    Returns (manifest or None, csv_found). A stale bundle keeps being served
+    while its replacement is built.
+    """
+    csv_path = exam_csv_path(exam)
+    if not csv_path:
+        return None, False
+    
+    manifest_path = image_bundle.manifest_path(BUNDLES_DIR, exam)
+    manifest = None
+    if os.path.isfile(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if not os.path.isfile(os.path.join(BUNDLES_DIR, manifest['archive'])):
+            manifest = None
+        elif os.path.getmtime(manifest_path) >= os.path.getmtime(csv_path):
+            return manifest, True
+    
+    start_bundle_build(exam, csv_path)
+    return manifest, True
+
+def bundle_building_response(exam):
+    """202 telling the client to come back once the bundle is built"""
+    response = jsonify({'status': 'building', 'exam': exam, 'retryAfter': BUNDLE_RETRY_AFTER})
+    response.status_code = 202
+    response.headers['Retry-After'] = str(BUNDLE_RETRY_AFTER)
+    return response
+
+@app.route('/api/exams/<exam>/bundle/manifest')
+def get_exam_bundle_manifest(exam):
+    """Manifest of an exam's image bundle (URL -> member offset, size, hash, dimensions)"""
+    manifest, csv_found = load_exam_bundle(exam)
+    if not csv_found:
+        return jsonify({'error': 'Exam not found'}), 404
+    if manifest is None:
+        return bundle_building_response(exam)
+    
+    response = jsonify(manifest)
+    response.set_etag(manifest['archiveSha256'])
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route('/api/exams/<exam>/bundle')
+def get_exam_bundle(exam):
+    """Download an exam's image bundle; supports Range and If-Range for resuming"""
+    manifest, csv_found = load_exam_bundle(exam)
+    if not csv_found:
+        return jsonify({'error': 'Exam not found'}), 404
+    if manifest is None:
+        return bundle_building_response(exam)
+    
+    # ETag is the archive hash from the manifest, so If-Range never resumes across builds
+    response = send_from_directory(BUNDLES_DIR, manifest['archive'], mimetype='application/x-tar',
+                                   as_attachment=True, download_name=f"{exam}.tar",
+                                   etag=manifest['archiveSha256'], max_age=0)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus metrics for all live workers"""
+    body = metrics.render(metrics.collect(metrics_registry, METRICS_DIR))
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+def require_admin_token(view):
+    """Only allow requests carrying ADMIN_API_TOKEN as a bearer token"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_API_TOKEN:
+            return jsonify({'error': 'Admin API disabled (set ADMIN_API_TOKEN)'}), 403
+        auth = request.headers.get('Authorization', '')
+        token = auth[len('Bearer '):] if auth.startswith('Bearer ') else ''
+        if not hmac.compare_digest(token.encode(), ADMIN_API_TOKEN.encode()):
+            return jsonify({'error': 'Unauthorized'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/api/admin/negative-cache', methods=['GET'])
+@require_admin_token
+def list_negative_cache():
+    """List URLs currently backed off after failed downloads"""
+    entries = [{
+        'url': entry['key'],
+        'failureClass': entry['failure_class'],
+        'error': entry['error'],
+        'failures': entry['failures'],
+        'failedAt': datetime.fromtimestamp(entry['failed_at']).isoformat(),
+        'retryAt': datetime.fromtimestamp(entry['retry_at']).isoformat()
+    } for entry in negative_cache.entries()]
+    return jsonify({'entries': entries, 'total': len(entries)})
+
+@app.route('/api/admin/negative-cache', methods=['DELETE'])
+@require_admin_token
+def purge_negative_cache():
+    """Purge one URL (?url=...) or every entry from the negative cache"""
+    url = request.args.get('url')
+    if url:
+        purged = 1 if negative_cache.clear(url) else 0
+    else:
+        purged = negative_cache.purge()
+    logger.info(f"🧹 Purged {purged} negative cache entries")
+    return jsonify({'success': True, 'purged': purged})
+
 @app.route('/api/upload-image', methods=['POST'])
 def upload_image():
     """Direct file upload endpoint"""
     try:
-        if 'file' not in request.files:
+        # Refuse oversized bodies before the multipart form is parsed
+        if request.content_length and request.content_length > MAX_FILE_SIZE + UPLOAD_FORM_OVERHEAD:
+            return jsonify({'error': f'File too large. Max size: {MAX_FILE_SIZE} bytes'}), 413
+        
+        # Parsing writes and hashes file parts straight into IMAGES_DIR (see UploadSpool)
+        try:
+            files = request.files
+        except RequestEntityTooLarge:
+            return jsonify({'error': f'File too large. Max size: {MAX_FILE_SIZE} bytes'}), 413
+        
+        if 'file' not in files:
             return jsonify({'error': 'No file provided'}), 400
         
-        file = request.files['file']
+        file = files['file']
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
@@ -352,41 +1734,25 @@ def upload_image():
         if ext not in ALLOWED_EXTENSIONS:
             return jsonify({'error': f'Invalid file type. Allowed: {list(ALLOWED_EXTENSIONS)}'}), 400
         
-        # Read file data
-        file_data = file.read()
-        if len(file_data) > MAX_FILE_SIZE:
-            return jsonify({'error': f'File too large. Max size: {MAX_FILE_SIZE} bytes'}), 400
-        
-        # Generate unique filename
-        file_hash = hashlib.md5(file_data).hexdigest()[:8]
-        public_id = f"upload_{file_hash}"
-        
-        # Save with Cloudinary (with local fallback)
-        if CLOUDINARY_ENABLED:
-            cloudinary_url = upload_to_cloudinary(file_data, public_id)
-            if cloudinary_url:
-                return jsonify({
-                    'success': True,
-                    'url': cloudinary_url,
-                    'storage': 'cloudinary'
-                })
-        
-        # Local fallback
-        filename = f"{public_id}{ext}"
-        filepath = os.path.join(IMAGES_DIR, filename)
+        temp_path, content_hash, size = receive_upload(file)
         
-        with open(filepath, 'wb') as f:
-            f.write(file_data)
+        # Same content-addressed save path as downloaded images (Cloudinary with local fallback)
+        stored_url = save_image_with_cloudinary_fallback(
+            f"{UPLOAD_SOURCE_PREFIX}{content_hash}{ext}", temp_path, content_hash, size)
         
         return jsonify({
             'success': True,
-            'url': f"/api/images/{filename}",
-            'storage': 'local'
+            'url': stored_url,
+            'storage': storage_tier(stored_url)
         })
         
     except Exception as e:
         logger.error(f"Upload error: {e}")
         return jsonify({'error': str(e)}), 500
+    finally:
+        # Extra, rejected or aborted parts
+        for spool in g.get('upload_spools', []):
+            spool.discard()
 
 if __name__ == '__main__':
     print("🚀 Image Processing Server Starting...")
@@ -397,6 +1763,8 @@ if __name__ == '__main__':
     print("  POST /api/process-images - Process image URLs")
     print("  GET  /api/images/<filename> - Serve processed images")
     print("  GET  /api/health - Health check")
+    print("  GET  /api/health/live - Liveness probe")
+    print("  GET  /api/health/ready - Readiness probe")
     print("  GET  /api/stats - Server statistics")
     print("\nPress Ctrl+C to stop the server")
     
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Exam CSV Helpers
+Reading image references out of exam CSVs, shared by the image maintenance
+commands (image_gc.py, image_prefetch.py).
+
+Image columns hold pipe-separated URLs, the same format the Flutter CSV
+import reads.
+"""
+
+import os
+import csv
+import glob
+import logging
+
+logger = logging.getLogger(__name__)
+
+IMAGE_COLUMNS = ('question_images', 'answer_images')
+
+def find_csv_files(paths):
+    """Expand CSV files and directories of CSV files"""
+    csv_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            csv_files.extend(sorted(glob.glob(os.path.join(path, '*.csv'))))
+        elif os.path.isfile(path):
+            csv_files.append(path)
+        else:
+            logger.warning(f"Skipping missing path: {path}")
+    return csv_files
+
+def iter_csv_image_references(csv_file):
+    """Yield every image reference in the image columns of one CSV"""
+    with open(csv_file, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            for column in IMAGE_COLUMNS:
+                for reference in (row.get(column) or '').split('|'):
+                    reference = reference.strip()
+                    if reference:
+                        yield reference
+
+def iter_image_references(csv_files):
+    """Yield every image reference in the image columns of the CSV files"""
+    for csv_file in csv_files:
+        yield from iter_csv_image_references(csv_file)
@@ -3,10 +3,16 @@ import os
 # Gunicorn configuration
 bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
 workers = 2
-worker_class = "sync"
+# Job event streams (/api/process-images/jobs/<id>/events) are only served by
+# threaded workers: GUNICORN_WORKER_CLASS=gthread with GUNICORN_THREADS > 1
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
 worker_connections = 1000
 timeout = 30
 keepalive = 2
 max_requests = 1000
 max_requests_jitter = 50
-preload_app = True 
\ No newline at end of file
+preload_app = True
+
+# Let sync workers hand image files to the kernel (wsgi.file_wrapper -> sendfile)
+sendfile = True
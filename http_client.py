@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Shared HTTP Client
+A process-wide pooled requests.Session used by the image server and the
+scrapers, so TCP/TLS handshakes are paid once per host instead of once per
+request. Adds configurable timeouts and retry with jittered backoff.
+"""
+
+import os
+import random
+import threading
+import time
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 10))
+READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 30))
+POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 20))  # Distinct hosts kept pooled
+POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 10))  # Keep-alive connections per host
+DEFAULT_MAX_ATTEMPTS = int(os.environ.get('HTTP_MAX_ATTEMPTS', 3))
+BACKOFF_BASE = float(os.environ.get('HTTP_BACKOFF_BASE', 0.5))  # Seconds
+BACKOFF_MAX = float(os.environ.get('HTTP_BACKOFF_MAX', 10))  # Seconds
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Only advertise brotli when we can actually decode it
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+def _create_session():
+    """Build a session with per-host connection pools"""
+    session = requests.Session()
+    # Retries are handled in request() so backoff can be jittered
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({
+        'Accept-Encoding': ACCEPT_ENCODING,
+        'Connection': 'keep-alive',
+    })
+    return session
+
+def get_session():
+    """Return the shared session for this process"""
+    global _session, _session_pid
+    # Sockets must not be shared with forked gunicorn workers
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                _session = _create_session()
+                _session_pid = os.getpid()
+    return _session
+
+def backoff_delay(attempt, base=BACKOFF_BASE):
+    """Full-jitter exponential backoff for the given (0-based) attempt"""
+    return random.uniform(0, min(BACKOFF_MAX, base * (2 ** attempt)))
+
+def _retry_after(response):
+    """Parse a numeric Retry-After header, if present"""
+    value = response.headers.get('Retry-After', '')
+    return min(float(value), BACKOFF_MAX) if value.isdigit() else None
+
+def request(method, url, headers=None, timeout=None, max_attempts=None, backoff=BACKOFF_BASE,
+            decompress=True, stream=False, **kwargs):
+    """Send a request through the shared session with retry and jittered backoff
+
+    Connection errors, timeouts and 429/5xx responses are retried up to
+    max_attempts in total. Set decompress=False to ask the origin for an
+    unencoded body. The final response is returned without raise_for_status().
+    """
+    max_attempts = max_attempts or DEFAULT_MAX_ATTEMPTS
+    timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+    headers = dict(headers or {})
+    headers.setdefault('Accept-Encoding', ACCEPT_ENCODING if decompress else 'identity')
+    session = get_session()
+
+    for attempt in range(max_attempts):
+        last_attempt = attempt == max_attempts - 1
+        try:
+            response = session.request(method, url, headers=headers, timeout=timeout, stream=stream, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if last_attempt:
+                raise
+            delay = backoff_delay(attempt, backoff)
+            logger.warning(f"Attempt {attempt + 1} failed for {url}: {e}; retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+
+        if response.status_code in RETRY_STATUS_CODES and not last_attempt:
+            delay = _retry_after(response) or backoff_delay(attempt, backoff)
+            logger.warning(f"Attempt {attempt + 1} got HTTP {response.status_code} for {url}; retrying in {delay:.1f}s")
+            response.close()
+            time.sleep(delay)
+            continue
+
+        return response
+
+def get(url, **kwargs):
+    """GET through the shared session"""
+    return request('GET', url, **kwargs)
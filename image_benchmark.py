@@ -0,0 +1,609 @@
+#!/usr/bin/env python3
+"""
+Image Server Benchmark
+Measures api.py latency, throughput and memory on this machine, so a change
+can be compared against the previous run before it is deployed.
+
+The server is started under gunicorn with the production config, against two
+local stand-ins with configurable injected latency:
+
+- an origin serving synthetic PNGs of several sizes (every URL is new bytes)
+- a Cloudinary stand-in for the Upload and Admin API calls the server makes
+  (CLOUDINARY_UPLOAD_PREFIX points the SDK at it), so no real account is used
+
+Each scenario is driven at every concurrency level:
+
+- process_cold: POST /api/process-images with URLs never seen before
+- process_warm: POST /api/process-images with already stored URLs (index hits)
+- images: GET /api/images/<filename> of stored images
+- upload: POST /api/upload-image with new bytes
+
+Results (p50/p95/p99 latency, throughput, errors and peak RSS of the gunicorn
+process tree, read from /proc) are written as JSON:
+
+    python image_benchmark.py --output before.json
+    python image_benchmark.py --baseline before.json --output after.json
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import shutil
+import random
+import socket
+import struct
+import argparse
+import logging
+import platform
+import itertools
+import subprocess
+import tempfile
+import threading
+from datetime import datetime
+from functools import lru_cache
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+IMAGE_SIZES = {'small': 16 * 1024, 'medium': 256 * 1024, 'large': 2 * 1024 * 1024}  # Approximate PNG bytes
+SIZE_WEIGHTS = {'small': 70, 'medium': 25, 'large': 5}  # Mix of origin images, percent
+SCENARIOS = ('process_cold', 'process_warm', 'images', 'upload')
+CLOUDINARY_MODES = ('write-behind', 'sync', 'off')
+CLOUD_NAME = 'benchmark'
+SERVER_START_TIMEOUT = 30  # Seconds
+RSS_SAMPLE_INTERVAL = 0.1  # Seconds
+REQUEST_TIMEOUT = 60  # Seconds, above gunicorn's worker timeout
+
+ORIGIN_PATH = re.compile(r'/images/(?P<size>[a-z]+)/(?P<seq>\d+)\.png')
+UPLOAD_PATH = re.compile(rf'/v1_1/{CLOUD_NAME}/image/upload')
+RESOURCES_PATH = re.compile(rf'/v1_1/{CLOUD_NAME}/resources/image/upload(?:/(?P<public_id>.+))?')
+
+@lru_cache(maxsize=64)
+def synthetic_png(seed, size):
+    """A valid PNG of roughly size bytes, same bytes for the same seed
+
+    Pixels are noise, so the image does not compress below its nominal size.
+    """
+    rng = random.Random(seed)
+    width = 256
+    row_bytes = width * 3
+    height = max(1, size // (row_bytes + 1))
+    pixels = rng.randbytes(row_bytes * height)
+    raw = b''.join(b'\x00' + pixels[row * row_bytes:(row + 1) * row_bytes] for row in range(height))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(raw, 1)) + chunk(b'IEND', b'')
+
+class StubServer(ThreadingHTTPServer):
+    """Threaded HTTP server that sleeps `latency` seconds before every response"""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, handler, latency):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)  # Clients closing idle keep-alive connections is normal
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def begin(self):
+        with self.server.lock:
+            self.server.requests += 1
+        time.sleep(self.server.latency)
+
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, data):
+        self.send_body(status, json.dumps(data).encode(), 'application/json')
+
+    def log_message(self, format, *args):
+        pass  # One line per request would drown the report
+
+class OriginHandler(StubHandler):
+    """Origin serving /images/<size>/<seq>.png"""
+
+    def do_GET(self):
+        self.begin()
+        match = ORIGIN_PATH.fullmatch(urlparse(self.path).path)
+        if not match or match['size'] not in IMAGE_SIZES:
+            self.send_json(404, {'error': 'Not found'})
+            return
+        body = synthetic_png(f"origin-{match['size']}-{match['seq']}", IMAGE_SIZES[match['size']])
+        self.send_body(200, body, 'image/png')
+
+class CloudinaryHandler(StubHandler):
+    """The Upload and Admin API endpoints api.py calls, backed by an in-memory dict"""
+
+    def resource(self, public_id, size):
+        return {
+            'public_id': public_id,
+            'secure_url': f"https://res.cloudinary.com/{CLOUD_NAME}/image/upload/v1/{public_id}.png",
+            'bytes': size,
+            'format': 'png',
+            'created_at': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        }
+
+    def do_GET(self):
+        self.begin()
+        parsed = urlparse(self.path)
+        resources = self.server.resources
+        if parsed.path == f'/v1_1/{CLOUD_NAME}/ping':
+            self.send_json(200, {'status': 'ok'})
+        elif parsed.path == f'/v1_1/{CLOUD_NAME}/usage':
+            self.send_json(200, {'resources': len(resources), 'storage': {'usage': sum(r['bytes'] for r in resources.values())}})
+        elif match := RESOURCES_PATH.fullmatch(parsed.path):
+            if match['public_id']:
+                resource = resources.get(match['public_id'])
+                if resource:
+                    self.send_json(200, resource)
+                else:
+                    self.send_json(404, {'error': {'message': f"Resource not found - {match['public_id']}"}})
+            else:
+                public_ids = parse_qs(parsed.query).get('public_ids[]', [])
+                self.send_json(200, {'resources': [resources[p] for p in public_ids if p in resources]})
+        else:
+            self.send_json(404, {'error': {'message': 'Unknown endpoint'}})
+
+    def do_POST(self):
+        self.begin()
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not UPLOAD_PATH.fullmatch(urlparse(self.path).path):
+            self.send_json(404, {'error': {'message': 'Unknown endpoint'}})
+            return
+
+        form = BytesParser(policy=policy.HTTP).parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+        fields = {}
+        for part in form.iter_parts():
+            fields[part.get_param('name', header='content-disposition')] = part.get_payload(decode=True)
+        public_id = fields.get('public_id', b'').decode()
+        if fields.get('folder'):
+            public_id = f"{fields['folder'].decode()}/{public_id}"
+        resource = self.resource(public_id, len(fields.get('file', b'')))
+        self.server.resources[public_id] = resource
+        self.send_json(200, resource)
+
+class CloudinaryStub(StubServer):
+    def __init__(self, latency):
+        super().__init__(CloudinaryHandler, latency)
+        self.resources = {}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def process_tree(root_pid):
+    """root_pid and all its descendants, from /proc"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces; ppid is the second field after it
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pids = [root_pid]
+    for pid in pids:
+        pids.extend(children.get(pid, []))
+    return pids
+
+def rss_bytes(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+class RssSampler:
+    """Tracks the peak total RSS of a process tree (gunicorn master + workers)"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.available = pid is not None and os.path.isdir('/proc')
+        self.peak = 0
+        self.overall_peak = 0
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.available:
+            threading.Thread(target=self._run, name='rss-sampler', daemon=True).start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL):
+            self._sample()
+
+    def _sample(self):
+        total = sum(rss_bytes(pid) for pid in process_tree(self.pid))
+        with self._lock:
+            self.peak = max(self.peak, total)
+            self.overall_peak = max(self.overall_peak, total)
+
+    def reset(self):
+        """Start measuring a new peak; returns the previous one (None without /proc)"""
+        if not self.available:
+            return None
+        # Sampled on both sides, so runs shorter than the interval still get a value
+        self._sample()
+        with self._lock:
+            peak, self.peak = self.peak, 0
+        self._sample()
+        return peak
+
+    def stop(self):
+        self._stop.set()
+
+def start_server(workdir, env_overrides, workers):
+    """Run api.py under gunicorn with every store in workdir; returns (process, base_url)"""
+    port = free_port()
+    env = {key: value for key, value in os.environ.items() if not key.startswith('CLOUDINARY_')}
+    env.update({
+        'PORT': str(port),
+        'IMAGES_DIR': os.path.join(workdir, 'processed_images'),
+        'IMAGE_VARIANTS_DIR': os.path.join(workdir, 'processed_variants'),
+        'IMAGE_BUNDLES_DIR': os.path.join(workdir, 'processed_bundles'),
+        'IMAGE_INDEX_DB': os.path.join(workdir, 'image_index.db'),
+        'METRICS_DIR': os.path.join(workdir, 'metrics'),
+        'PERSISTENT_DATA_DIR': workdir,  # Local disk, so write-behind may be enabled
+        'PYTHONUNBUFFERED': '1'
+    })
+    env.update(env_overrides)
+
+    command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'api:app']
+    if workers:
+        command += ['--workers', str(workers)]
+    log = open(os.path.join(workdir, 'server.log'), 'wb')
+    process = subprocess.Popen(command, cwd=REPO_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            if requests.get(f"{base_url}/api/health/live", timeout=1).ok:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+
+    stop_server(process)
+    with open(os.path.join(workdir, 'server.log'), errors='replace') as f:
+        logger.error("Server log:\n" + ''.join(f.readlines()[-30:]))
+    raise RuntimeError("Image server did not become ready")
+
+def stop_server(process):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+def percentile(sorted_values, percent):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+    return sorted_values[int(rank) - 1]
+
+class Benchmark:
+    """Generates requests for each scenario and remembers what the server stored"""
+
+    def __init__(self, base_url, origin_url, batch_size, seed):
+        self.base_url = base_url
+        self.origin_url = origin_url
+        self.batch_size = batch_size
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.sequence = itertools.count()
+        self.stored_urls = []  # Origin URLs the server has resolved
+        self.local_files = []  # Filenames served by /api/images
+        self.lock = threading.Lock()
+
+    def new_origin_urls(self, count):
+        with self.lock:
+            sizes = self.rng.choices(list(SIZE_WEIGHTS), weights=list(SIZE_WEIGHTS.values()), k=count)
+            return [f"{self.origin_url}/images/{size}/{next(self.sequence)}.png" for size in sizes]
+
+    def pick(self, pool, count):
+        with self.lock:
+            return [self.rng.choice(pool) for _ in range(count)]
+
+    def prepare(self, scenario, i):
+        """(method, path, requests kwargs) of request i of a scenario"""
+        if scenario == 'process_cold':
+            return 'POST', '/api/process-images', {'json': {'imageUrls': self.new_origin_urls(self.batch_size)}}
+        if scenario == 'process_warm':
+            return 'POST', '/api/process-images', {'json': {'imageUrls': self.pick(self.stored_urls, self.batch_size)}}
+        if scenario == 'images':
+            return 'GET', f"/api/images/{self.pick(self.local_files, 1)[0]}", {}
+        if scenario == 'upload':
+            size = self.rng.choice(list(SIZE_WEIGHTS))
+            body = synthetic_png(f"upload-{self.seed}-{next(self.sequence)}", IMAGE_SIZES[size])
+            return 'POST', '/api/upload-image', {'files': {'file': (f"bench-{i}.png", body, 'image/png')}}
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+    def record(self, scenario, kwargs, response):
+        """Remember stored images from a response; returns whether it succeeded"""
+        if response.status_code != 200:
+            return False
+        if scenario == 'images':
+            return True
+
+        data = response.json()
+        if scenario == 'upload':
+            stored = [data['url']] if data.get('success') else []
+        else:
+            stored = data.get('processedImages', [])
+        with self.lock:
+            self.local_files.extend(url.rsplit('/', 1)[-1] for url in stored if url.startswith('/api/images/'))
+            if scenario == 'process_cold' and not data.get('totalErrors'):
+                self.stored_urls.extend(kwargs['json']['imageUrls'])
+        return not data.get('totalErrors') and bool(stored)
+
+    def seed_pool(self, count):
+        """Store count origin images, unmeasured, for the scenarios that read stored images"""
+        logger.info(f"🌱 Storing {count} images for the warm scenarios")
+        with requests.Session() as session:
+            for start in range(0, count, self.batch_size):
+                _, path, kwargs = self.prepare('process_cold', start)
+                response = session.post(f"{self.base_url}{path}", timeout=REQUEST_TIMEOUT, **kwargs)
+                self.record('process_cold', kwargs, response)
+
+    def run(self, scenario, concurrency, total_requests):
+        """Send total_requests requests from concurrency clients; returns the latencies and error count"""
+        latencies = []
+        errors = [0]
+        counter = itertools.count()
+        lock = threading.Lock()
+
+        def client():
+            with requests.Session() as session:
+                while (i := next(counter)) < total_requests:
+                    # Built before the clock starts: generating upload bytes is not server time
+                    method, path, kwargs = self.prepare(scenario, i)
+                    started = time.perf_counter()
+                    try:
+                        response = session.request(method, f"{self.base_url}{path}", timeout=REQUEST_TIMEOUT, **kwargs)
+                        response.content
+                        elapsed = time.perf_counter() - started
+                        ok = self.record(scenario, kwargs, response)
+                    except (requests.RequestException, ValueError):
+                        elapsed = time.perf_counter() - started
+                        ok = False
+                    with lock:
+                        latencies.append(elapsed)
+                        errors[0] += not ok
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=client, name=f'client-{n}') for n in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return latencies, errors[0], time.perf_counter() - started
+
+def summarize(scenario, concurrency, latencies, errors, duration, batch_size, peak_rss):
+    latencies = sorted(latencies)
+    ms = lambda value: round(value * 1000, 2) if value is not None else None
+    result = {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        'durationSeconds': round(duration, 3),
+        'throughputRps': round(len(latencies) / duration, 2) if duration else None,
+        'latencyMs': {
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'mean': ms(sum(latencies) / len(latencies)) if latencies else None,
+            'max': ms(latencies[-1] if latencies else None)
+        },
+        'peakRssBytes': peak_rss
+    }
+    if scenario.startswith('process_'):
+        result['imagesPerSecond'] = round(len(latencies) * batch_size / duration, 2) if duration else None
+    return result
+
+def change(current, previous):
+    if current is None or not previous:
+        return ''
+    return f"{(current - previous) / previous * 100:+.0f}%"
+
+def print_results(results, baseline=None, file=None):
+    """Print a results table, with changes against a baseline run if given"""
+    previous = {(r['scenario'], r['concurrency']): r for r in (baseline or {}).get('results', [])}
+    header = (f"{'Scenario':<14} {'Conc':>5} {'Reqs':>6} {'Errs':>5} {'Req/s':>9} "
+              f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'Peak RSS MB':>12}")
+    if baseline:
+        header += f" {'Δ req/s':>8} {'Δ p95':>7}"
+    print(header, file=file)
+    print('-' * len(header), file=file)
+    for result in results:
+        latency = result['latencyMs']
+        rss = f"{result['peakRssBytes'] / 1024 / 1024:.1f}" if result['peakRssBytes'] else '-'
+        line = (f"{result['scenario']:<14} {result['concurrency']:>5} {result['requests']:>6} {result['errors']:>5} "
+                f"{result['throughputRps'] or 0:>9} {latency['p50'] or 0:>9} {latency['p95'] or 0:>9} "
+                f"{latency['p99'] or 0:>9} {rss:>12}")
+        before = previous.get((result['scenario'], result['concurrency']))
+        if baseline and before:
+            line += (f" {change(result['throughputRps'], before['throughputRps']):>8}"
+                     f" {change(latency['p95'], before['latencyMs']['p95']):>7}")
+        print(line, file=file)
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def parse_env(pairs):
+    env = {}
+    for pair in pairs:
+        key, sep, value = pair.partition('=')
+        if not sep:
+            raise argparse.ArgumentTypeError(f"Expected KEY=VALUE, got {pair}")
+        env[key] = value
+    return env
+
+def main():
+    """Main function to benchmark the image server"""
+    parser = argparse.ArgumentParser(description='Benchmark the image server against local stand-in services')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4, 16],
+                        help='Concurrent clients, one run per level (default: 1 4 16)')
+    parser.add_argument('--requests', type=int, default=100, help='Requests per scenario and level (default: 100)')
+    parser.add_argument('--batch-size', type=int, default=5, help='URLs per /api/process-images request (default: 5)')
+    parser.add_argument('--origin-latency', type=float, default=0.05,
+                        help='Seconds the stub origin waits before each image (default: 0.05)')
+    parser.add_argument('--cloudinary-latency', type=float, default=0.1,
+                        help='Seconds the Cloudinary stand-in waits before each call (default: 0.1)')
+    parser.add_argument('--cloudinary', choices=CLOUDINARY_MODES, default='write-behind',
+                        help='How the server uses the Cloudinary stand-in (default: write-behind)')
+    parser.add_argument('--workers', type=int, help='gunicorn workers (default: gunicorn.conf.py)')
+    parser.add_argument('--server-env', nargs='*', default=[], metavar='KEY=VALUE',
+                        help='Extra environment for the server, e.g. IMAGE_MAX_WORKERS=16')
+    parser.add_argument('--seed', type=int, default=1, help='Seed for image sizes and contents (default: 1)')
+    parser.add_argument('--baseline', help='Earlier JSON report to compare against')
+    parser.add_argument('--output', help='Write the JSON report here (default: stdout)')
+    parser.add_argument('--keep-workdir', action='store_true', help="Keep the server's stores and log")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    origin = StubServer(OriginHandler, args.origin_latency).start()
+    cloud = CloudinaryStub(args.cloudinary_latency).start()
+    server_env = parse_env(args.server_env)
+    if args.cloudinary != 'off':
+        server_env.update({
+            'CLOUDINARY_CLOUD_NAME': CLOUD_NAME,
+            'CLOUDINARY_API_KEY': 'benchmark',
+            'CLOUDINARY_API_SECRET': 'benchmark',
+            'CLOUDINARY_UPLOAD_PREFIX': cloud.url,
+            'CLOUDINARY_WRITE_BEHIND': 'true' if args.cloudinary == 'write-behind' else 'false'
+        })
+
+    workdir = tempfile.mkdtemp(prefix='image-benchmark-')
+    process, base_url = start_server(workdir, server_env, args.workers)
+    sampler = RssSampler(process.pid).start()
+    logger.info(f"🚀 Server {base_url} (pid {process.pid}), workdir {workdir}")
+
+    results = []
+    try:
+        benchmark = Benchmark(base_url, origin.url, args.batch_size, args.seed)
+        for scenario in args.scenarios:
+            if scenario in ('process_warm', 'images') and not benchmark.stored_urls:
+                benchmark.seed_pool(max(args.batch_size, 50))
+            if scenario == 'images' and not benchmark.local_files:
+                logger.warning("⚠️ No images stored locally (Cloudinary in sync mode); skipping images")
+                continue
+
+            for concurrency in args.concurrency:
+                sampler.reset()
+                latencies, errors, duration = benchmark.run(scenario, concurrency, args.requests)
+                result = summarize(scenario, concurrency, latencies, errors, duration, args.batch_size, sampler.reset())
+                results.append(result)
+                logger.info(f"⏱️ {scenario} x{concurrency}: {result['throughputRps']} req/s, "
+                            f"p95 {result['latencyMs']['p95']} ms, {errors} errors")
+    finally:
+        sampler.stop()
+        stop_server(process)
+        origin.shutdown()
+        cloud.shutdown()
+        if args.keep_workdir:
+            logger.info(f"📁 Kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'startedAt': datetime.now().isoformat(),
+        'commit': git_commit(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count()
+        },
+        'config': {
+            'scenarios': args.scenarios,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'batchSize': args.batch_size,
+            'originLatency': args.origin_latency,
+            'cloudinaryLatency': args.cloudinary_latency,
+            'cloudinary': args.cloudinary,
+            'workers': args.workers,
+            'serverEnv': parse_env(args.server_env),
+            'imageSizes': IMAGE_SIZES,
+            'sizeWeights': SIZE_WEIGHTS,
+            'seed': args.seed
+        },
+        'stubs': {'originRequests': origin.requests, 'cloudinaryRequests': cloud.requests},
+        'peakRssBytes': sampler.overall_peak if sampler.available else None,
+        'results': results
+    }
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"📝 Report written to {args.output}")
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    # The table goes to stderr when the JSON report is on stdout
+    print_results(results, baseline, file=None if args.output else sys.stderr)
+    return 1 if any(result['errors'] for result in results) else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Exam Image Bundles
+Packs every image an exam references into one uncompressed tar archive, so
+the app's offline mode can pull a whole exam in a single resumable (Range)
+transfer instead of hundreds of small requests.
+
+Next to each archive is a JSON manifest. It maps every source URL to its
+member's byte offset and size in the archive, plus its SHA-256 and pixel
+dimensions, so a client can slice images straight out of the download. The
+manifest is also the archive's last member.
+
+    python image_bundle.py csv/az800_examtopics_cleaned_final.csv
+"""
+
+import os
+import re
+import json
+import hashlib
+import tarfile
+import tempfile
+import mimetypes
+import argparse
+import logging
+from datetime import datetime
+
+# Pillow is optional - without it dimensions are left out of the manifest
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_MEMBER = 'manifest.json'
+HASH_CHUNK_SIZE = 64 * 1024
+
+def file_sha256(path):
+    """SHA-256 hex digest of a file, read in chunks"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def image_dimensions(path):
+    """(width, height) of an image, or (None, None) if unknown"""
+    if not PIL_AVAILABLE:
+        return None, None
+    try:
+        # Only the header is read
+        with Image.open(path) as img:
+            return img.width, img.height
+    except Exception:
+        return None, None
+
+def manifest_path(directory, exam):
+    """Path of an exam's bundle manifest"""
+    return os.path.join(directory, f"{exam}.json")
+
+def remove_old_archives(directory, exam, keep):
+    """Delete an exam's archives other than keep
+
+    Downloads already streaming an old archive keep their open file.
+    """
+    pattern = re.compile(re.escape(exam) + r'\.[0-9a-f]{16}\.tar')
+    for name in os.listdir(directory):
+        if name != keep and pattern.fullmatch(name):
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+def write_bundle(directory, exam, members, missing):
+    """Write an exam's archive and manifest, replacing any previous bundle
+
+    members is a list of dicts with 'member' (archive name), 'path' (file to
+    pack) and 'urls' (source URLs resolving to it). missing maps URLs that
+    could not be packed to the reason. Returns the manifest.
+
+    Archives are named after their hash and never rewritten, so the manifest
+    always points at an archive matching its offsets.
+    """
+    os.makedirs(directory, exist_ok=True)
+    images = {}
+
+    fd, temp_tar = tempfile.mkstemp(dir=directory, prefix='.bundle-', suffix='.part')
+    os.close(fd)
+    try:
+        with tarfile.open(temp_tar, 'w', format=tarfile.USTAR_FORMAT) as tar:
+            for entry in members:
+                info = tarfile.TarInfo(entry['member'])
+                info.size = os.path.getsize(entry['path'])
+                info.mtime = int(os.path.getmtime(entry['path']))
+                info.mode = 0o644
+                with open(entry['path'], 'rb') as f:
+                    tar.addfile(info, f)
+                # addfile() packs a copy of info, so take the offset from the stream:
+                # the data ends the member, padded to a whole block
+                data_offset = tar.offset - -(-info.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+                width, height = image_dimensions(entry['path'])
+                details = {
+                    'member': entry['member'],
+                    'offset': data_offset,
+                    'size': info.size,
+                    'sha256': file_sha256(entry['path']),
+                    'width': width,
+                    'height': height,
+                    'contentType': mimetypes.guess_type(entry['member'])[0] or 'application/octet-stream'
+                }
+                for url in entry['urls']:
+                    images[url] = details
+
+            manifest = {
+                'exam': exam,
+                'createdAt': datetime.now().isoformat(),
+                'imageCount': len(members),
+                'images': images,
+                'missing': missing
+            }
+            manifest_bytes = json.dumps(manifest, indent=2).encode()
+            info = tarfile.TarInfo(MANIFEST_MEMBER)
+            info.size = len(manifest_bytes)
+            info.mtime = int(datetime.now().timestamp())
+            info.mode = 0o644
+            with tempfile.SpooledTemporaryFile() as f:
+                f.write(manifest_bytes)
+                f.seek(0)
+                tar.addfile(info, f)
+
+        # The archive hash is its ETag, so a resumed transfer can't mix two builds
+        archive_sha256 = file_sha256(temp_tar)
+        manifest['archive'] = f"{exam}.{archive_sha256[:16]}.tar"
+        manifest['archiveSize'] = os.path.getsize(temp_tar)
+        manifest['archiveSha256'] = archive_sha256
+        os.replace(temp_tar, os.path.join(directory, manifest['archive']))
+    finally:
+        if os.path.exists(temp_tar):
+            os.remove(temp_tar)
+
+    fd, temp_manifest = tempfile.mkstemp(dir=directory, prefix='.manifest-', suffix='.part')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(temp_manifest, manifest_path(directory, exam))
+    finally:
+        if os.path.exists(temp_manifest):
+            os.remove(temp_manifest)
+
+    remove_old_archives(directory, exam, manifest['archive'])
+    return manifest
+
+def main():
+    """Main function to build exam image bundles"""
+    parser = argparse.ArgumentParser(description='Package every image an exam CSV references into one archive')
+    parser.add_argument('paths', nargs='*', default=['csv'], help='Exam CSV files or directories of CSVs')
+    parser.add_argument('--output-dir', help='Where to write bundles (default: the server bundle directory)')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger('api').setLevel(logging.WARNING)
+
+    # Imported here: the server module imports this one
+    import api
+    from exam_csv import find_csv_files
+
+    csv_files = find_csv_files(args.paths)
+    if not csv_files:
+        logger.error("No CSV files found")
+        return 1
+
+    for csv_file in csv_files:
+        exam = os.path.splitext(os.path.basename(csv_file))[0]
+        manifest = api.build_exam_bundle(exam, csv_file, args.output_dir or api.BUNDLES_DIR)
+        logger.info(f"📦 {exam}: {manifest['imageCount']} images, {manifest['archiveSize']} bytes, "
+                    f"{len(manifest['missing'])} missing -> {manifest['archive']}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
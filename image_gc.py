@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Image Garbage Collector
+Deletes stored images that no exam CSV references any more.
+
+The live reference set is built from the question_images/answer_images
+columns (pipe-separated) of every CSV given. A reference keeps an image alive
+whether it is the original origin URL, an /api/images/... URL or a Cloudinary
+URL. Everything else is deleted:
+
+- local files in processed_images (and their variants)
+- resources under the Cloudinary examtopic_images folder, in batches of 100
+- index entries for the deleted images
+
+Content-addressed names (SHA-256) can only be tied to a CSV reference through
+the index, so a hash the index doesn't know is never deleted: a fresh or lost
+index (e.g. after a redeploy on an ephemeral disk) keeps everything instead
+of deleting everything.
+
+Images stored less than --min-age-hours ago are kept, so an import still in
+progress is never collected. Always start with a dry run:
+
+    python image_gc.py csv --dry-run
+"""
+
+import os
+import re
+import argparse
+import logging
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+import api
+import image_storage
+from exam_csv import find_csv_files, iter_image_references
+from image_index import legacy_content_key
+
+logger = logging.getLogger(__name__)
+
+CLOUDINARY_DELETE_BATCH_SIZE = 100  # Max public IDs per Admin API delete_resources call
+CLOUDINARY_LIST_PAGE_SIZE = 500
+VARIANT_PATTERN = re.compile(r'^(?P<stem>.+)_w\d+_h\d+_q\d+_[a-z]+\.[a-z]+$')
+CONTENT_HASH_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+def build_live_keys(references):
+    """Content keys (hashes and legacy keys) of every referenced image"""
+    live_keys = set()
+    for reference in references:
+        parsed = urlparse(reference)
+        stem = os.path.splitext(os.path.basename(parsed.path))[0]
+
+        if '/api/images/' in parsed.path:
+            # Already rewritten to one of our local URLs
+            key = api.local_content_key(os.path.basename(parsed.path))
+            if key:
+                live_keys.add(key)
+            else:
+                live_keys.add(stem)  # Direct upload
+            continue
+
+        if 'cloudinary.com' in parsed.netloc:
+            # .../image/upload/v123/examtopic_images/<key>.png
+            live_keys.update((stem, legacy_content_key(stem)))
+            continue
+
+        # Origin URL: whatever the index resolved it to, plus its pre-index legacy name
+        entry = api.image_index.lookup(reference)
+        if entry:
+            live_keys.add(entry['content_hash'])
+        live_keys.add(legacy_content_key(api.generate_filename(reference).split('.')[0]))
+    return live_keys
+
+def is_live_stem(stem, live_keys):
+    """Whether a stored file or resource named stem is referenced"""
+    return stem in live_keys or legacy_content_key(stem) in live_keys
+
+def is_collectable_stem(stem, live_keys, known_hashes):
+    """Whether a stored file or resource named stem may be deleted
+    
+    Legacy names are derived from the referencing URL itself, but a content
+    hash is only known to be unreferenced if the index has a record of it.
+    """
+    if is_live_stem(stem, live_keys):
+        return False
+    if CONTENT_HASH_PATTERN.fullmatch(stem):
+        return stem in known_hashes
+    return True
+
+def known_content_hashes():
+    """Content hashes the index has a record of"""
+    return {entry['content_hash'] for entry in api.image_index.all_contents()}
+
+def collect_local(live_keys, known_hashes, min_age, dry_run, include_uploads=False):
+    """Delete unreferenced local images and their variants; returns (files, bytes)"""
+    cutoff = datetime.now().timestamp() - min_age
+    deleted = 0
+    freed = 0
+    for filename, path in list(image_storage.iter_stored_files(api.IMAGES_DIR)):
+        stem = os.path.splitext(filename)[0]
+        if not is_collectable_stem(stem, live_keys, known_hashes):
+            continue
+        if filename.startswith('upload_') and not include_uploads:
+            continue
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if stat.st_mtime > cutoff:
+            continue
+
+        logger.debug(f"Unreferenced local image: {filename}")
+        deleted += 1
+        freed += api.delete_local_file(filename) if not dry_run else stat.st_size
+
+    variants = 0
+    for filename, path in list(image_storage.iter_stored_files(api.VARIANTS_DIR)):
+        match = VARIANT_PATTERN.match(filename)
+        if not match or not is_collectable_stem(match.group('stem'), live_keys, known_hashes):
+            continue
+        if match.group('stem').startswith('upload_') and not include_uploads:
+            continue
+        variants += 1
+        if not dry_run:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    action = 'Would delete' if dry_run else 'Deleted'
+    logger.info(f"🗑️ {action} {deleted} local images ({freed} bytes) and {variants} variants")
+    return deleted, freed
+
+def iter_cloudinary_resources():
+    """Yield every uploaded resource under the Cloudinary folder"""
+    next_cursor = None
+    while True:
+        kwargs = {'next_cursor': next_cursor} if next_cursor else {}
+        result = api.cloudinary.api.resources(
+            type='upload',
+            prefix=f"{api.CLOUDINARY_FOLDER}/",
+            max_results=CLOUDINARY_LIST_PAGE_SIZE,
+            **kwargs
+        )
+        yield from result.get('resources', [])
+        next_cursor = result.get('next_cursor')
+        if not next_cursor:
+            break
+
+def collect_cloudinary(live_keys, known_hashes, min_age, dry_run, include_uploads=False):
+    """Delete unreferenced Cloudinary resources in batches; returns (resources, bytes)"""
+    cutoff = datetime.now(timezone.utc).timestamp() - min_age
+    orphans = []
+    freed = 0
+    for resource in iter_cloudinary_resources():
+        stem = resource['public_id'].rsplit('/', 1)[-1]
+        if not is_collectable_stem(stem, live_keys, known_hashes):
+            continue
+        if stem.startswith('upload_') and not include_uploads:
+            continue
+        created_at = resource.get('created_at')
+        if created_at and datetime.fromisoformat(created_at.replace('Z', '+00:00')).timestamp() > cutoff:
+            continue
+        orphans.append(resource['public_id'])
+        freed += resource.get('bytes', 0)
+
+    if not dry_run:
+        for start in range(0, len(orphans), CLOUDINARY_DELETE_BATCH_SIZE):
+            batch = orphans[start:start + CLOUDINARY_DELETE_BATCH_SIZE]
+            api.cloudinary.api.delete_resources(batch)
+            logger.info(f"☁️ Deleted Cloudinary batch {start // CLOUDINARY_DELETE_BATCH_SIZE + 1}: {len(batch)} resources")
+
+    action = 'Would delete' if dry_run else 'Deleted'
+    logger.info(f"☁️ {action} {len(orphans)} Cloudinary resources ({freed} bytes)")
+    return len(orphans), freed
+
+def collect_index(live_keys, min_age, dry_run):
+    """Drop index entries (and queued promotions) of unreferenced images; returns the count"""
+    cutoff = datetime.now().timestamp() - min_age
+    orphans = [
+        entry['content_hash'] for entry in api.image_index.all_contents()
+        if entry['content_hash'] not in live_keys and entry['updated_at'] <= cutoff
+    ]
+    if not dry_run:
+        for content_hash in orphans:
+            api.image_index.remove_content(content_hash)
+            api.image_index.complete_promotion(content_hash)
+
+    action = 'Would drop' if dry_run else 'Dropped'
+    logger.info(f"📇 {action} {len(orphans)} index entries")
+    return len(orphans)
+
+def main():
+    """Main function to garbage-collect unreferenced images"""
+    parser = argparse.ArgumentParser(description='Delete stored images no exam CSV references')
+    parser.add_argument('paths', nargs='*', default=['csv'], help='Exam CSV files or directories of CSVs')
+    parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+    parser.add_argument('--min-age-hours', type=float, default=24,
+                        help='Keep images stored more recently than this (default: 24)')
+    parser.add_argument('--skip-local', action='store_true', help='Leave local files alone')
+    parser.add_argument('--skip-cloudinary', action='store_true', help='Leave Cloudinary resources alone')
+    parser.add_argument('--include-uploads', action='store_true',
+                        help='Also delete unreferenced direct uploads')
+    parser.add_argument('--verbose', '-v', action='store_true', help='List every unreferenced image')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+
+    csv_files = find_csv_files(args.paths)
+    if not csv_files:
+        # An empty reference set would delete everything
+        logger.error("No CSV files found; refusing to run")
+        return 1
+
+    live_keys = build_live_keys(iter_image_references(csv_files))
+    if not args.include_uploads:
+        # Direct uploads are not in any CSV until an exam is saved with them
+        live_keys |= api.image_index.aliased_content_hashes(api.UPLOAD_SOURCE_PREFIX)
+    logger.info(f"🔎 {len(csv_files)} CSV files reference {len(live_keys)} image keys")
+    
+    known_hashes = known_content_hashes()
+    if not known_hashes:
+        logger.warning(f"⚠️ The index ({api.IMAGE_INDEX_DB}) has no stored images; "
+                       "content-addressed images will all be kept")
+
+    min_age = args.min_age_hours * 3600
+    if not args.skip_local:
+        collect_local(live_keys, known_hashes, min_age, args.dry_run, args.include_uploads)
+    if not args.skip_cloudinary:
+        if api.CLOUDINARY_ENABLED:
+            collect_cloudinary(live_keys, known_hashes, min_age, args.dry_run, args.include_uploads)
+        else:
+            logger.info("Cloudinary not configured, skipping")
+    collect_index(live_keys, min_age, args.dry_run)
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,724 @@
+#!/usr/bin/env python3
+"""
+Image Index
+Persistent SQLite index of stored images, so repeat requests for the same
+image need no network calls.
+
+Images are content-addressed: each stored copy is keyed by the SHA-256 of its
+bytes, and source URLs are aliases pointing at a content hash. Images stored
+before content addressing are keyed by their legacy URL-hash name instead
+(see legacy_content_key()).
+
+The database runs in WAL mode and doubles as the cache shared by all gunicorn
+workers on the host: a mapping or failure learned by one worker is seen by
+the others, and survives worker recycling.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+BUSY_TIMEOUT = 30  # Seconds a writer waits for another worker's transaction
+MMAP_SIZE = 64 * 1024 * 1024  # Bytes of the database read through a shared memory map
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contents (
+    content_hash TEXT PRIMARY KEY,
+    stored_url TEXT NOT NULL,
+    storage TEXT NOT NULL,
+    size_bytes INTEGER,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS aliases (
+    source_url TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_aliases_content_hash ON aliases (content_hash);
+CREATE TABLE IF NOT EXISTS storage_stats (
+    name TEXT PRIMARY KEY,
+    file_count INTEGER NOT NULL,
+    total_bytes INTEGER NOT NULL,
+    reconciled_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS promotions (
+    content_hash TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    lease_until REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_promotions_due ON promotions (status, next_attempt_at);
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    processed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, position)
+);
+CREATE TABLE IF NOT EXISTS negative_cache (
+    key TEXT PRIMARY KEY,
+    failure_class TEXT NOT NULL,
+    error TEXT,
+    failures INTEGER NOT NULL,
+    failed_at REAL NOT NULL,
+    retry_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_negative_cache_retry_at ON negative_cache (retry_at);
+CREATE TABLE IF NOT EXISTS local_files (
+    filename TEXT PRIMARY KEY,
+    content_hash TEXT,
+    size_bytes INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_local_files_last_access ON local_files (last_access);
+CREATE INDEX IF NOT EXISTS idx_local_files_content_hash ON local_files (content_hash);
+CREATE TABLE IF NOT EXISTS task_runs (
+    name TEXT PRIMARY KEY,
+    last_run REAL NOT NULL
+);
+"""
+
+LEGACY_PREFIX = 'legacy:'
+# storage_stats row counting local files whose image is also on Cloudinary
+PROMOTED_LOCAL_STORAGE = 'local-promoted'
+
+def legacy_content_key(legacy_name):
+    """Content key for an image stored under its old URL-hash name"""
+    return f"{LEGACY_PREFIX}{legacy_name}"
+
+class ImageIndex:
+    """SQLite-backed index of content hash -> stored image, with URL aliases"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        # Create the schema on a throwaway connection so no connection is
+        # inherited by forked gunicorn workers
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT)
+        try:
+            # WAL lets workers read while another one writes; the mode is stored in the file
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._migrate_url_table(conn)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _migrate_url_table(self, conn):
+        """Fold the old URL-keyed images table into contents/aliases"""
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'images'"
+        ).fetchone()
+        if not exists:
+            return
+        rows = conn.execute(
+            "SELECT source_url, content_hash, stored_url, storage, size_bytes, updated_at FROM images"
+        ).fetchall()
+        for source_url, content_hash, stored_url, storage, size_bytes, updated_at in rows:
+            key = content_hash or legacy_content_key(stored_url.rsplit('/', 1)[-1].split('.')[0])
+            conn.execute(
+                "INSERT OR IGNORE INTO contents VALUES (?, ?, ?, ?, ?)",
+                (key, stored_url, storage, size_bytes, updated_at)
+            )
+            conn.execute("INSERT OR IGNORE INTO aliases VALUES (?, ?, ?)", (source_url, key, updated_at))
+        conn.execute("DROP TABLE images")
+        logger.info(f"Migrated {len(rows)} URL-keyed index entries to content-addressed index")
+
+    def _connection(self):
+        """Get this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        # A connection opened before fork must not be used by the child
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT)
+            conn.row_factory = sqlite3.Row
+            # Safe with WAL: a crash can only lose the last commits, never corrupt the file
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def lookup(self, source_url):
+        """Return the stored image a source URL points at, or None"""
+        row = self._connection().execute(
+            """
+            SELECT a.source_url, c.content_hash, c.stored_url, c.storage, c.size_bytes, c.updated_at
+            FROM aliases a JOIN contents c ON c.content_hash = a.content_hash
+            WHERE a.source_url = ?
+            """,
+            (source_url,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def lookup_content(self, content_hash):
+        """Return the stored image for a content hash, or None"""
+        row = self._connection().execute(
+            "SELECT * FROM contents WHERE content_hash = ?", (content_hash,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def record(self, source_url, content_hash, stored_url, storage, size_bytes=None):
+        """Record a stored image and point a source URL at it"""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            row = conn.execute(
+                "SELECT storage FROM contents WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+            self._move_promoted_content(conn, content_hash, row['storage'] if row else None, storage)
+            conn.execute(
+                """
+                INSERT INTO contents (content_hash, stored_url, storage, size_bytes, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(content_hash) DO UPDATE SET
+                    stored_url = excluded.stored_url,
+                    storage = excluded.storage,
+                    size_bytes = COALESCE(excluded.size_bytes, contents.size_bytes),
+                    updated_at = excluded.updated_at
+                """,
+                (content_hash, stored_url, storage, size_bytes, now)
+            )
+            self._write_alias(conn, source_url, content_hash, now)
+
+    def record_alias(self, source_url, content_hash):
+        """Point a source URL at an already stored content hash"""
+        conn = self._connection()
+        with conn:
+            self._write_alias(conn, source_url, content_hash, time.time())
+
+    def _write_alias(self, conn, source_url, content_hash, now):
+        conn.execute(
+            """
+            INSERT INTO aliases (source_url, content_hash, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(source_url) DO UPDATE SET
+                content_hash = excluded.content_hash,
+                updated_at = excluded.updated_at
+            """,
+            (source_url, content_hash, now)
+        )
+
+    def update_content(self, content_hash, stored_url, storage):
+        """Move a stored image to a new URL/storage tier, keeping its aliases"""
+        conn = self._connection()
+        with conn:
+            row = conn.execute(
+                "SELECT storage FROM contents WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+            conn.execute(
+                "UPDATE contents SET stored_url = ?, storage = ?, updated_at = ? WHERE content_hash = ?",
+                (stored_url, storage, time.time(), content_hash)
+            )
+            if row:
+                self._move_promoted_content(conn, content_hash, row['storage'], storage)
+
+    def mark_evicted(self, content_hash):
+        """Record that a local-only image's file was evicted, keeping its aliases
+
+        Its stored URL stays valid: the image is downloaded again from an
+        origin alias when it is next requested.
+        """
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "UPDATE contents SET storage = 'evicted', updated_at = ? WHERE content_hash = ? AND storage = 'local'",
+                (time.time(), content_hash)
+            )
+
+    def origin_urls(self, content_hash):
+        """Source URLs a stored image can be downloaded again from, most recent first"""
+        rows = self._connection().execute(
+            """
+            SELECT source_url FROM aliases
+            WHERE content_hash = ? AND source_url LIKE 'http%'
+            ORDER BY updated_at DESC
+            """,
+            (content_hash,)
+        ).fetchall()
+        return [row['source_url'] for row in rows]
+
+    def remove_content(self, content_hash):
+        """Drop a stored image and every URL alias pointing at it"""
+        conn = self._connection()
+        with conn:
+            row = conn.execute(
+                "SELECT storage FROM contents WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+            if row:
+                self._move_promoted_content(conn, content_hash, row['storage'], None)
+            conn.execute("DELETE FROM aliases WHERE content_hash = ?", (content_hash,))
+            conn.execute("DELETE FROM contents WHERE content_hash = ?", (content_hash,))
+
+    def _move_promoted_content(self, conn, content_hash, old_storage, new_storage):
+        """Move an image's local files in or out of the promoted counters when it changes tier"""
+        if (old_storage == 'cloudinary') == (new_storage == 'cloudinary'):
+            return
+        local = conn.execute(
+            "SELECT COUNT(*) AS files, COALESCE(SUM(size_bytes), 0) AS total FROM local_files WHERE content_hash = ?",
+            (content_hash,)
+        ).fetchone()
+        sign = 1 if new_storage == 'cloudinary' else -1
+        if local['files']:
+            self._adjust_storage_stats(conn, PROMOTED_LOCAL_STORAGE, sign * local['files'], sign * local['total'])
+
+    def get_storage_stats(self, name):
+        """Return the file_count/total_bytes counters for a storage area, or None"""
+        row = self._connection().execute(
+            "SELECT * FROM storage_stats WHERE name = ?", (name,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def adjust_storage_stats(self, name, files_delta, bytes_delta):
+        """Apply a write (positive) or delete (negative) to a storage area's counters"""
+        conn = self._connection()
+        with conn:
+            self._adjust_storage_stats(conn, name, files_delta, bytes_delta)
+
+    def _adjust_storage_stats(self, conn, name, files_delta, bytes_delta):
+        conn.execute("INSERT OR IGNORE INTO storage_stats VALUES (?, 0, 0, 0)", (name,))
+        conn.execute(
+            """
+            UPDATE storage_stats
+            SET file_count = MAX(file_count + ?, 0), total_bytes = MAX(total_bytes + ?, 0)
+            WHERE name = ?
+            """,
+            (files_delta, bytes_delta, name)
+        )
+
+    def claim_storage_reconcile(self, name, max_age):
+        """Claim the next reconcile scan if the counters are older than max_age seconds
+
+        Only one process wins each claim, so workers don't all rescan the disk.
+        """
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO storage_stats VALUES (?, 0, 0, 0)", (name,))
+            cursor = conn.execute(
+                "UPDATE storage_stats SET reconciled_at = ? WHERE name = ? AND reconciled_at <= ?",
+                (now, name, now - max_age)
+            )
+        return cursor.rowcount == 1
+
+    def set_storage_stats(self, name, file_count, total_bytes):
+        """Replace a storage area's counters with the result of a full scan"""
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO storage_stats VALUES (?, ?, ?, ?)",
+                (name, file_count, total_bytes, time.time())
+            )
+
+    def enqueue_promotion(self, content_hash, filename):
+        """Queue a locally stored image for background upload to Cloudinary"""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                """
+                INSERT OR IGNORE INTO promotions
+                    (content_hash, filename, status, attempts, next_attempt_at, created_at)
+                VALUES (?, ?, 'pending', 0, ?, ?)
+                """,
+                (content_hash, filename, now, now)
+            )
+
+    def claim_promotion(self, lease_seconds):
+        """Claim the next due promotion job, or return None
+
+        Jobs whose lease expired (their worker died mid-upload) are claimed again.
+        """
+        now = time.time()
+        conn = self._connection()
+        # IMMEDIATE takes the write lock up front so two workers can't claim the same job
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                """
+                SELECT * FROM promotions
+                WHERE (status = 'pending' AND next_attempt_at <= ?)
+                   OR (status = 'in_progress' AND lease_until <= ?)
+                ORDER BY next_attempt_at LIMIT 1
+                """,
+                (now, now)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE promotions SET status = 'in_progress', lease_until = ? WHERE content_hash = ?",
+                    (now + lease_seconds, row['content_hash'])
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return dict(row) if row else None
+
+    def complete_promotion(self, content_hash):
+        """Remove a finished promotion job"""
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM promotions WHERE content_hash = ?", (content_hash,))
+
+    def retry_promotion(self, content_hash, error, delay, max_attempts):
+        """Record a failed attempt, rescheduling the job or marking it failed"""
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                """
+                UPDATE promotions SET
+                    attempts = attempts + 1,
+                    status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END,
+                    next_attempt_at = ?,
+                    lease_until = NULL,
+                    last_error = ?
+                WHERE content_hash = ?
+                """,
+                (max_attempts, time.time() + delay, error, content_hash)
+            )
+
+    def promotion_counts(self):
+        """Number of promotion jobs per status"""
+        rows = self._connection().execute(
+            "SELECT status, COUNT(*) AS count FROM promotions GROUP BY status"
+        ).fetchall()
+        return {row['status']: row['count'] for row in rows}
+
+    def create_job(self, job_id, urls):
+        """Persist a new batch job with one pending item per URL"""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT INTO jobs (job_id, status, total, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?)",
+                (job_id, len(urls), now, now)
+            )
+            conn.executemany(
+                "INSERT INTO job_items (job_id, position, url) VALUES (?, ?, ?)",
+                ((job_id, position, url) for position, url in enumerate(urls))
+            )
+
+    def get_job(self, job_id):
+        """Return a job's status and progress counters, or None"""
+        row = self._connection().execute(
+            "SELECT * FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def claim_job(self, lease_seconds):
+        """Claim the oldest queued job, or return None
+
+        Running jobs whose lease expired (their worker died or was recycled)
+        are claimed again and resume from their first unfinished item.
+        """
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                """
+                SELECT * FROM jobs
+                WHERE status = 'queued' OR (status = 'running' AND lease_until <= ?)
+                ORDER BY created_at LIMIT 1
+                """,
+                (now,)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', lease_until = ?, updated_at = ? WHERE job_id = ?",
+                    (now + lease_seconds, now, row['job_id'])
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return dict(row) if row else None
+
+    def pending_job_items(self, job_id, limit):
+        """Up to limit unfinished items of a job as (position, url), in order"""
+        rows = self._connection().execute(
+            "SELECT position, url FROM job_items WHERE job_id = ? AND done = 0 ORDER BY position LIMIT ?",
+            (job_id, limit)
+        ).fetchall()
+        return [(row['position'], row['url']) for row in rows]
+
+    def record_job_item(self, job_id, position, result, error, lease_seconds):
+        """Store one item's outcome, update the job's counters and extend its lease"""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE job_items SET done = 1, result = ?, error = ? WHERE job_id = ? AND position = ? AND done = 0",
+                (result, error, job_id, position)
+            )
+            if cursor.rowcount:
+                conn.execute(
+                    """
+                    UPDATE jobs SET
+                        processed = processed + 1,
+                        failed = failed + ?,
+                        lease_until = ?,
+                        updated_at = ?
+                    WHERE job_id = ?
+                    """,
+                    (1 if error is not None else 0, now + lease_seconds, now, job_id)
+                )
+
+    def finish_job(self, job_id):
+        """Mark a job whose items are all done as completed"""
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'completed', lease_until = NULL, updated_at = ? WHERE job_id = ?",
+                (time.time(), job_id)
+            )
+
+    def job_items(self, job_id):
+        """All finished items of a job, in submission order"""
+        rows = self._connection().execute(
+            "SELECT position, url, result, error FROM job_items WHERE job_id = ? AND done = 1 ORDER BY position",
+            (job_id,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def purge_jobs(self, older_than):
+        """Delete completed jobs last updated before the given timestamp"""
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                """
+                DELETE FROM job_items WHERE job_id IN (
+                    SELECT job_id FROM jobs WHERE status = 'completed' AND updated_at < ?
+                )
+                """,
+                (older_than,)
+            )
+            cursor = conn.execute(
+                "DELETE FROM jobs WHERE status = 'completed' AND updated_at < ?", (older_than,)
+            )
+        return cursor.rowcount
+
+    def get_negative(self, key):
+        """Return the negative cache entry for a key, or None"""
+        row = self._connection().execute(
+            "SELECT * FROM negative_cache WHERE key = ?", (key,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def record_negative(self, key, failure_class, error, base_delay, max_delay):
+        """Record a failure, doubling the key's backoff window per consecutive failure
+
+        Entries whose window ended more than max_delay ago are dropped, so a
+        URL that recovers and fails much later starts again from base_delay.
+        """
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            # Prune first, so a stale entry for this key is not counted as consecutive
+            conn.execute("DELETE FROM negative_cache WHERE retry_at < ?", (now - max_delay,))
+            conn.execute(
+                """
+                INSERT INTO negative_cache (key, failure_class, error, failures, failed_at, retry_at)
+                VALUES (?, ?, ?, 1, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    failure_class = excluded.failure_class,
+                    error = excluded.error,
+                    failures = negative_cache.failures + 1,
+                    failed_at = excluded.failed_at,
+                    retry_at = excluded.failed_at + MIN(? * (1 << MIN(negative_cache.failures, 30)), ?)
+                """,
+                (key, failure_class, error, now, now + min(base_delay, max_delay), base_delay, max_delay)
+            )
+            row = conn.execute("SELECT * FROM negative_cache WHERE key = ?", (key,)).fetchone()
+        return dict(row)
+
+    def remove_negative(self, key):
+        """Drop a key's negative cache entry; returns True if there was one"""
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute("DELETE FROM negative_cache WHERE key = ?", (key,))
+        return cursor.rowcount == 1
+
+    def purge_negative(self):
+        """Drop every negative cache entry; returns how many were removed"""
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute("DELETE FROM negative_cache")
+        return cursor.rowcount
+
+    def negative_entries(self):
+        """All negative cache entries, most recent failure last"""
+        rows = self._connection().execute(
+            "SELECT * FROM negative_cache ORDER BY failed_at"
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def record_local_file(self, filename, content_hash, size_bytes):
+        """Track a file written to local storage as just accessed
+
+        content_hash is None for files that must never be evicted.
+        """
+        conn = self._connection()
+        with conn:
+            replaced = self._promoted_file_size(conn, filename)
+            conn.execute(
+                "INSERT OR REPLACE INTO local_files VALUES (?, ?, ?, ?)",
+                (filename, content_hash, size_bytes, time.time())
+            )
+            self._adjust_promoted_file(conn, replaced, self._promoted_file_size(conn, filename))
+
+    def remove_local_file(self, filename):
+        """Stop tracking a deleted local file"""
+        conn = self._connection()
+        with conn:
+            removed = self._promoted_file_size(conn, filename)
+            conn.execute("DELETE FROM local_files WHERE filename = ?", (filename,))
+            self._adjust_promoted_file(conn, removed, None)
+
+    def _promoted_file_size(self, conn, filename):
+        """Size of a tracked local file whose image is on Cloudinary, else None"""
+        row = conn.execute(
+            """
+            SELECT lf.size_bytes FROM local_files lf JOIN contents c ON c.content_hash = lf.content_hash
+            WHERE lf.filename = ? AND c.storage = 'cloudinary'
+            """,
+            (filename,)
+        ).fetchone()
+        return row['size_bytes'] if row else None
+
+    def _adjust_promoted_file(self, conn, old_size, new_size):
+        """Move the promoted counters from a file's old state to its new one"""
+        files_delta = (new_size is not None) - (old_size is not None)
+        bytes_delta = (new_size or 0) - (old_size or 0)
+        if files_delta or bytes_delta:
+            self._adjust_storage_stats(conn, PROMOTED_LOCAL_STORAGE, files_delta, bytes_delta)
+
+    def touch_local_files(self, accesses):
+        """Apply buffered (filename, accessed_at) pairs to the LRU access times"""
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "UPDATE local_files SET last_access = MAX(last_access, ?) WHERE filename = ?",
+                ((accessed_at, filename) for filename, accessed_at in accesses)
+            )
+
+    def sync_local_files(self, files, scan_started):
+        """Make local_files match a full disk scan of (filename, content_hash, size, mtime)
+
+        New files start with their mtime as last access. Rows for files the
+        scan did not see are dropped, unless they were written after it began.
+        The promoted counters are recounted from the result.
+        """
+        conn = self._connection()
+        with conn:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS scanned_files (filename TEXT PRIMARY KEY)")
+            conn.execute("DELETE FROM scanned_files")
+            conn.executemany("INSERT OR IGNORE INTO scanned_files VALUES (?)", ((f[0],) for f in files))
+            conn.executemany(
+                """
+                INSERT INTO local_files VALUES (?, ?, ?, ?)
+                ON CONFLICT(filename) DO UPDATE SET size_bytes = excluded.size_bytes
+                """,
+                files
+            )
+            conn.execute(
+                """
+                DELETE FROM local_files
+                WHERE last_access < ? AND filename NOT IN (SELECT filename FROM scanned_files)
+                """,
+                (scan_started,)
+            )
+            conn.execute("DELETE FROM scanned_files")
+            # Recount the promoted counters from the reconciled table
+            promoted = conn.execute(
+                """
+                SELECT COUNT(*) AS files, COALESCE(SUM(lf.size_bytes), 0) AS total
+                FROM local_files lf JOIN contents c ON c.content_hash = lf.content_hash
+                WHERE c.storage = 'cloudinary'
+                """
+            ).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO storage_stats VALUES (?, ?, ?, ?)",
+                (PROMOTED_LOCAL_STORAGE, promoted['files'], promoted['total'], time.time())
+            )
+
+    def eviction_candidates(self, limit):
+        """Local files that may be evicted, in eviction order
+
+        Files whose image is already on Cloudinary go first, then files that
+        can be downloaded again from an origin URL, each least recently used
+        first. Files without a content hash (direct uploads), files with only
+        non-URL aliases and files still waiting for promotion are kept.
+        """
+        rows = self._connection().execute(
+            """
+            SELECT lf.filename, lf.content_hash, lf.size_bytes, c.storage
+            FROM local_files lf LEFT JOIN contents c ON c.content_hash = lf.content_hash
+            WHERE lf.content_hash IS NOT NULL AND (
+                c.storage = 'cloudinary'
+                OR (
+                    NOT EXISTS (SELECT 1 FROM promotions p WHERE p.content_hash = lf.content_hash)
+                    AND (c.content_hash IS NULL OR EXISTS (
+                        SELECT 1 FROM aliases a
+                        WHERE a.content_hash = lf.content_hash AND a.source_url LIKE 'http%'
+                    ))
+                )
+            )
+            ORDER BY CASE WHEN c.storage = 'cloudinary' THEN 0 ELSE 1 END, lf.last_access
+            LIMIT ?
+            """,
+            (limit,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def promoted_local_bytes(self):
+        """Bytes of local files whose image is also on Cloudinary (evicted first), from the counters"""
+        stats = self.get_storage_stats(PROMOTED_LOCAL_STORAGE)
+        return stats['total_bytes'] if stats else 0
+
+    def claim_task(self, name, interval):
+        """Claim a periodic task if it has not run for interval seconds
+
+        Only one process wins each claim, so workers take turns.
+        """
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO task_runs VALUES (?, 0)", (name,))
+            cursor = conn.execute(
+                "UPDATE task_runs SET last_run = ? WHERE name = ? AND last_run <= ?",
+                (now, name, now - interval)
+            )
+        return cursor.rowcount == 1
+
+    def all_contents(self):
+        """Every stored image (content_hash, stored_url, storage, size_bytes, updated_at)"""
+        rows = self._connection().execute("SELECT * FROM contents").fetchall()
+        return [dict(row) for row in rows]
+
+    def aliased_content_hashes(self, prefix):
+        """Content hashes with at least one alias starting with prefix"""
+        rows = self._connection().execute(
+            "SELECT DISTINCT content_hash FROM aliases WHERE substr(source_url, 1, ?) = ?",
+            (len(prefix), prefix)
+        ).fetchall()
+        return {row['content_hash'] for row in rows}
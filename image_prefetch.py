@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Image Prefetch
+Warms the image store and URL index for exam CSVs before they are published,
+so no student pays the first download/upload.
+
+Every http(s) URL in the question_images/answer_images columns is run
+through the same concurrent pipeline as /api/process-images. Each image is
+recorded in the index as soon as it is stored, so an interrupted run can be
+started again and picks up where it stopped: finished images are index hits.
+
+    python image_prefetch.py csv
+    python image_prefetch.py csv/az800_examtopics_cleaned_final.csv --retry-failed
+"""
+
+import os
+import json
+import time
+import argparse
+import logging
+
+import api
+from exam_csv import find_csv_files, iter_csv_image_references
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_CHUNK_SIZE = 200  # URLs handed to the batch pipeline at a time
+
+def prefetch_exam(csv_file, retry_failed=False):
+    """Fetch every image one exam CSV references; returns the exam's summary"""
+    started = time.monotonic()
+    references = list(iter_csv_image_references(csv_file))
+    urls = list(dict.fromkeys(
+        reference for reference in references
+        if reference.startswith(('http://', 'https://')) and not api.is_already_processed_url(reference)
+    ))
+
+    # Already indexed images cost nothing, which is also what makes a rerun resume
+    pending = [url for url in urls if not api.image_index.lookup(url)]
+    if retry_failed:
+        for url in pending:
+            api.negative_cache.clear(url)
+
+    summary = {
+        'exam': os.path.splitext(os.path.basename(csv_file))[0],
+        'references': len(references),
+        'uniqueUrls': len(urls),
+        'alreadyCached': len(urls) - len(pending),
+        'fetched': 0,
+        'failed': 0,
+        'errors': {}
+    }
+    logger.info(f"📚 {summary['exam']}: {len(urls)} image URLs, {len(pending)} to fetch")
+
+    for start in range(0, len(pending), PREFETCH_CHUNK_SIZE):
+        chunk = pending[start:start + PREFETCH_CHUNK_SIZE]
+        for _, item in api.iter_image_results(chunk):
+            if item['error'] is None:
+                summary['fetched'] += 1
+            else:
+                summary['failed'] += 1
+                summary['errors'][item['url']] = item['error']
+        done = start + len(chunk)
+        logger.info(f"   {summary['exam']}: {done}/{len(pending)} processed, {summary['failed']} failed")
+
+    summary['elapsedSeconds'] = round(time.monotonic() - started, 1)
+    return summary
+
+def print_summary(summaries):
+    """Print a per-exam results table"""
+    header = f"{'Exam':<50} {'URLs':>6} {'Cached':>7} {'Fetched':>8} {'Failed':>7} {'Time':>8}"
+    print(header)
+    print('-' * len(header))
+    for summary in summaries:
+        print(f"{summary['exam'][:50]:<50} {summary['uniqueUrls']:>6} {summary['alreadyCached']:>7} "
+              f"{summary['fetched']:>8} {summary['failed']:>7} {summary['elapsedSeconds']:>7}s")
+
+def main():
+    """Main function to prefetch images for exam CSVs"""
+    parser = argparse.ArgumentParser(description='Download and store every image referenced by exam CSVs')
+    parser.add_argument('paths', nargs='*', default=['csv'], help='Exam CSV files or directories of CSVs')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='Retry URLs that are backing off after a recent failure')
+    parser.add_argument('--report', help='Write the per-exam summary (with errors) to this JSON file')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    # Per-image pipeline logs would drown the progress lines
+    logging.getLogger('api').setLevel(logging.WARNING)
+
+    csv_files = find_csv_files(args.paths)
+    if not csv_files:
+        logger.error("No CSV files found")
+        return 1
+
+    summaries = [prefetch_exam(csv_file, args.retry_failed) for csv_file in csv_files]
+    print_summary(summaries)
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(summaries, f, indent=2)
+        logger.info(f"📝 Report written to {args.report}")
+
+    return 1 if any(summary['failed'] for summary in summaries) else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,5 +1,4 @@
 import os
-import requests
 import hashlib
 from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
@@ -9,9 +8,9 @@ from datetime import datetime
 import logging
 import cloudinary
 import cloudinary.uploader
-import cloudinary.config
 import cloudinary.api
 import cloudinary.exceptions
+import http_client
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -71,11 +70,9 @@ def download_image(url):
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
             'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
             'Accept-Language': 'en-US,en;q=0.9',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Connection': 'keep-alive',
         }
         
-        response = requests.get(url, headers=headers, timeout=30)
+        response = http_client.get(url, headers=headers, decompress=False)
         response.raise_for_status()
         
         # Check file size
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Image Storage Layout
+Two-level hash-sharded layout for locally stored images:
+
+    processed_images/ab/cd/abcd1234....png
+
+Filenames are content or URL hashes, so their first four hex characters
+spread files evenly over 65536 small directories. Public URLs keep using the
+bare filename; only the on-disk location is sharded.
+
+Run as a script to migrate an existing flat directory in place:
+
+    python image_storage.py processed_images
+"""
+
+import os
+import hashlib
+import string
+import argparse
+import logging
+
+logger = logging.getLogger(__name__)
+
+HEX_DIGITS = set(string.hexdigits.lower())
+
+def shard_key(filename):
+    """Hex key used to pick a file's shard directories"""
+    key = os.path.splitext(filename)[0].lower()
+    if len(key) >= 4 and set(key[:4]) <= HEX_DIGITS:
+        return key
+    # Names that don't start with a hash (e.g. upload_xxxx) are sharded by their own hash
+    return hashlib.md5(filename.encode()).hexdigest()
+
+def shard_relative_path(filename):
+    """Relative path of a file in the sharded layout"""
+    key = shard_key(filename)
+    return os.path.join(key[:2], key[2:4], filename)
+
+def shard_path(root, filename):
+    """Path of a file in the sharded layout under root"""
+    return os.path.join(root, shard_relative_path(filename))
+
+def resolve_relative_path(root, filename):
+    """Relative path of an existing stored file, or None
+
+    Looks in the sharded layout first, then in the legacy flat layout for
+    directories that have not been migrated yet.
+    """
+    if os.path.basename(filename) != filename or filename.startswith('.'):
+        return None
+    relative_path = shard_relative_path(filename)
+    if os.path.isfile(os.path.join(root, relative_path)):
+        return relative_path
+    if os.path.isfile(os.path.join(root, filename)):
+        return filename
+    return None
+
+def resolve_path(root, filename):
+    """Path of an existing stored file, or None"""
+    relative_path = resolve_relative_path(root, filename)
+    return os.path.join(root, relative_path) if relative_path else None
+
+def prepare_path(root, filename):
+    """Sharded path for a new file, creating its shard directories"""
+    path = shard_path(root, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+def iter_stored_files(root):
+    """Yield (filename, path) for every stored file, skipping temp files"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for filename in filenames:
+            if not filename.startswith('.'):
+                yield filename, os.path.join(dirpath, filename)
+
+def migrate_flat_layout(root, dry_run=False):
+    """Move files from the top level of a flat directory into shards
+
+    Returns the number of files moved (or that would be moved).
+    """
+    moved = 0
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if not entry.is_file() or entry.name.startswith('.'):
+                continue
+            target = shard_path(root, entry.name)
+            if not dry_run:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(entry.path, target)
+            moved += 1
+    return moved
+
+def main():
+    """Main function to migrate a flat image directory"""
+    parser = argparse.ArgumentParser(description='Migrate a flat image directory to the sharded layout')
+    parser.add_argument('directories', nargs='*', default=['processed_images', 'processed_variants'],
+                        help='Image directories to migrate')
+    parser.add_argument('--dry-run', action='store_true', help='Only report how many files would move')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    for directory in args.directories:
+        if not os.path.isdir(directory):
+            logger.warning(f"Skipping missing directory: {directory}")
+            continue
+        moved = migrate_flat_layout(directory, dry_run=args.dry_run)
+        action = 'Would move' if args.dry_run else 'Moved'
+        logger.info(f"{action} {moved} files into shards under {directory}")
+
+if __name__ == "__main__":
+    main()
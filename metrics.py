@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Metrics
+Minimal thread-safe counters, gauges and histograms rendered in the
+Prometheus text exposition format.
+
+Each gunicorn worker keeps its own values in memory, which costs a dict
+update and a lock per observation. Workers periodically publish a snapshot
+to a shared directory (publish_snapshot()). /metrics merges the snapshots of
+all live workers (collect()), so a scrape sees the whole server regardless
+of which worker answers it. Counters and histograms of exited workers are
+folded into an archived snapshot, so merged totals never go down when
+gunicorn recycles a worker; their gauges are dropped.
+"""
+
+import os
+import json
+import time
+import tempfile
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+# POSIX only; without it archiving is not serialised between workers
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ARCHIVE_FILENAME = 'archived.json'  # Summed counters and histograms of exited workers
+
+class Metric:
+    """A named metric family with a fixed set of label names"""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """Copy of (label values, value) pairs"""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """Value that goes up and down, e.g. work in flight"""
+
+    type = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track_in_progress(self, **labels):
+        """Count the enclosed block as in flight while it runs"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(Metric):
+    """Distribution of observed values over fixed buckets"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket (non-cumulative) counts plus an overflow slot, sum, count
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            return [[list(key), [list(counts), total, count]] for key, (counts, total, count) in self._values.items()]
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the enclosed block's duration, labelled outcome='ok' or 'error'
+
+        The block may set a more specific outcome on the yielded dict.
+        """
+        outcome = {'outcome': 'ok'}
+        started = time.perf_counter()
+        try:
+            yield outcome
+        except BaseException:
+            outcome['outcome'] = 'error'
+            raise
+        finally:
+            self.observe(time.perf_counter() - started, **labels, **outcome)
+
+class Registry:
+    """A set of metrics that are exported together"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self):
+        """JSON-serialisable copy of every metric's current values"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            metric.name: {
+                'type': metric.type,
+                'help': metric.documentation,
+                'labels': list(metric.labelnames),
+                'buckets': list(getattr(metric, 'buckets', ())),
+                'samples': metric.samples()
+            }
+            for metric in metrics
+        }
+
+def merge_snapshots(snapshots):
+    """Sum several processes' snapshots into one"""
+    merged = {}
+    for snapshot in snapshots:
+        for name, family in snapshot.items():
+            target = merged.setdefault(name, {**family, 'values': {}})
+            for label_values, value in family['samples']:
+                key = tuple(label_values)
+                current = target['values'].get(key)
+                if family['type'] != 'histogram':
+                    target['values'][key] = (current or 0) + value
+                elif current is None or len(current[0]) != len(value[0]):
+                    target['values'][key] = [list(value[0]), value[1], value[2]]
+                else:
+                    current[0] = [a + b for a, b in zip(current[0], value[0])]
+                    current[1] += value[1]
+                    current[2] += value[2]
+    return merged
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render(snapshots):
+    """Prometheus text exposition of the merged snapshots"""
+    lines = []
+    for name, family in sorted(merge_snapshots(snapshots).items()):
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        labelnames = family['labels']
+        for label_values, value in sorted(family['values'].items()):
+            if family['type'] != 'histogram':
+                lines.append(f"{name}{_labels(labelnames, label_values)} {_number(value)}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip(family['buckets'] + ['+Inf'], counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == '+Inf' else f'le="{bound}"'
+                lines.append(f"{name}_bucket{_labels(labelnames, label_values, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labelnames, label_values)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(labelnames, label_values)} {count}")
+    return '\n'.join(lines) + '\n'
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _write_snapshot(snapshot, directory, filename):
+    """Write a snapshot to directory/filename atomically"""
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.snapshot-', suffix='.part')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(temp_path, os.path.join(directory, filename))
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def _read_snapshot(path):
+    """Snapshot stored at path, or None if it is missing or being replaced"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def publish_snapshot(registry, directory):
+    """Write this process's snapshot to directory/<pid>.json atomically"""
+    _write_snapshot(registry.snapshot(), directory, f"{os.getpid()}.json")
+
+@contextmanager
+def _archive_lock(directory):
+    """Hold an exclusive lock on the archive while it is updated"""
+    with open(os.path.join(directory, '.archive.lock'), 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+def archive_snapshot(directory, path):
+    """Add a dead worker's counters and histograms to the archive, then delete its snapshot
+
+    Several workers may find the same dead snapshot; only the first one to
+    take the lock archives it.
+    """
+    with _archive_lock(directory):
+        if not os.path.exists(path):
+            return
+        snapshot = _read_snapshot(path)
+        if snapshot is not None:
+            archive_path = os.path.join(directory, ARCHIVE_FILENAME)
+            kept = {name: family for name, family in snapshot.items() if family['type'] != 'gauge'}
+            merged = merge_snapshots([_read_snapshot(archive_path) or {}, kept])
+            _write_snapshot({
+                name: {
+                    'type': family['type'],
+                    'help': family['help'],
+                    'labels': family['labels'],
+                    'buckets': family['buckets'],
+                    'samples': [[list(key), value] for key, value in family['values'].items()]
+                }
+                for name, family in merged.items()
+            }, directory, ARCHIVE_FILENAME)
+        os.remove(path)
+
+def collect(registry, directory):
+    """This process's live snapshot, the published snapshots of other live workers and the archive
+
+    Snapshots left behind by exited workers are moved into the archive first.
+    """
+    snapshots = [registry.snapshot()]
+    if not os.path.isdir(directory):
+        return snapshots
+    for entry in os.listdir(directory):
+        pid_text, ext = os.path.splitext(entry)
+        if ext != '.json' or not pid_text.isdigit() or int(pid_text) == os.getpid():
+            continue
+        path = os.path.join(directory, entry)
+        if not _pid_alive(int(pid_text)):
+            try:
+                archive_snapshot(directory, path)
+            except OSError:
+                pass  # Retried on the next scrape
+            continue
+        snapshot = _read_snapshot(path)
+        if snapshot is not None:  # Otherwise being replaced; picked up on the next scrape
+            snapshots.append(snapshot)
+    # Read after archiving, so a worker that just exited is counted exactly once
+    archive = _read_snapshot(os.path.join(directory, ARCHIVE_FILENAME))
+    if archive is not None:
+        snapshots.append(archive)
+    return snapshots
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Negative Cache
+Remembers image URLs whose download failed, so repeat submissions of a dead
+origin URL fail immediately instead of tying up a worker until it times out
+again. Each consecutive failure doubles the URL's backoff window.
+
+Entries live in the image index database, so every gunicorn worker shares
+them and they survive worker recycling.
+"""
+
+import time
+
+class RecentlyFailedError(Exception):
+    """Raised instead of retrying a key that is inside its backoff window"""
+
+class NegativeCache:
+    """Failed-URL cache with exponential backoff per entry, stored in an ImageIndex"""
+
+    def __init__(self, index, base_delay, max_delay):
+        self.index = index
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def lookup(self, key):
+        """Return the entry for key (inside its backoff window or not), or None"""
+        return self.index.get_negative(key)
+
+    def is_backing_off(self, entry):
+        """True while an entry's backoff window is still open"""
+        return entry is not None and entry['retry_at'] > time.time()
+
+    def record_failure(self, key, failure_class, error):
+        """Record a failed attempt, extending the key's backoff window"""
+        return self.index.record_negative(key, failure_class, error, self.base_delay, self.max_delay)
+
+    def clear(self, key):
+        """Forget a key after it succeeded or was purged; returns True if it was cached"""
+        return self.index.remove_negative(key)
+
+    def purge(self):
+        """Forget every entry; returns how many were removed"""
+        return self.index.purge_negative()
+
+    def entries(self):
+        """All entries, most recent failure last"""
+        return self.index.negative_entries()
@@ -17,6 +17,10 @@ import logging
 from dataclasses import dataclass
 from datetime import datetime
 
+# The shared HTTP client lives at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import http_client
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -56,15 +60,12 @@ class ExamTopicsScraper:
     def __init__(self, delay: float = 1.0, max_retries: int = 3):
         self.delay = delay
         self.max_retries = max_retries
-        self.session = requests.Session()
-        self.session.headers.update({
+        self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
             'Accept-Language': 'en-US,en;q=0.5',
-            'Accept-Encoding': 'gzip, deflate',
-            'Connection': 'keep-alive',
             'Upgrade-Insecure-Requests': '1',
-        })
+        }
         
     def load_links_from_csv(self, csv_file: str) -> List[Dict[str, str]]:
         """Load links from CSV file"""
@@ -86,23 +87,20 @@ class ExamTopicsScraper:
     
     def get_page_content(self, url: str) -> Optional[BeautifulSoup]:
         """Get page content with retry logic"""
-        for attempt in range(self.max_retries):
-            try:
-                logger.info(f"Fetching: {url} (attempt {attempt + 1})")
-                response = self.session.get(url, timeout=30)
-                response.raise_for_status()
-                
-                soup = BeautifulSoup(response.content, 'html.parser')
-                time.sleep(self.delay)  # Be respectful to the server
-                return soup
-                
-            except requests.RequestException as e:
-                logger.warning(f"Attempt {attempt + 1} failed for {url}: {e}")
-                if attempt < self.max_retries - 1:
-                    time.sleep(self.delay * (attempt + 1))  # Exponential backoff
-                else:
-                    logger.error(f"Failed to fetch {url} after {self.max_retries} attempts")
-                    return None
+        try:
+            logger.info(f"Fetching: {url}")
+            # Retries with jittered backoff are handled by the shared client
+            response = http_client.get(url, headers=self.headers,
+                                       max_attempts=self.max_retries, backoff=self.delay)
+            response.raise_for_status()
+            
+            soup = BeautifulSoup(response.content, 'html.parser')
+            time.sleep(self.delay)  # Be respectful to the server
+            return soup
+            
+        except requests.RequestException as e:
+            logger.error(f"Failed to fetch {url} after {self.max_retries} attempts: {e}")
+            return None
     
     def extract_question_text(self, soup: BeautifulSoup) -> str:
         """Extract question text from the page"""
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Single-Flight Call Coalescing
+Runs at most one call per key at a time within a process. Threads asking
+for a key that is already in flight wait for that call and share its result
+(or its exception) instead of repeating the work.
+"""
+
+import threading
+
+class _Call:
+    """One in-flight call and its outcome"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """Call fn(*args, **kwargs) unless a call for key is already running
+
+        Returns (result, shared): shared is True when this thread waited for
+        another thread's call rather than running fn itself.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # Later callers start a fresh call; waiters already hold this one
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        """Number of keys currently being worked on"""
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Tests for local storage eviction
+Runs against a scratch image directory and index, and a local origin server
+"""
+
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# api.py reads its storage locations at import time
+SCRATCH_DIR = tempfile.mkdtemp(prefix='image-eviction-test-')
+os.environ['IMAGES_DIR'] = os.path.join(SCRATCH_DIR, 'processed_images')
+os.environ['IMAGE_VARIANTS_DIR'] = os.path.join(SCRATCH_DIR, 'processed_variants')
+os.environ['IMAGE_INDEX_DB'] = os.path.join(SCRATCH_DIR, 'image_index.db')
+os.environ['METRICS_DIR'] = os.path.join(SCRATCH_DIR, 'metrics')
+for name in ('CLOUDINARY_CLOUD_NAME', 'CLOUDINARY_API_KEY', 'CLOUDINARY_API_SECRET'):
+    os.environ.pop(name, None)
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import api
+
+# Smallest valid PNG: 1x1 transparent pixel
+PNG_BYTES = bytes.fromhex(
+    '89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c489'
+    '0000000d49444154789c6360000002000100e221bc330000000049454e44ae426082'
+)
+
+class OriginHandler(BaseHTTPRequestHandler):
+    """Serves PNG_BYTES for every path and counts the requests"""
+
+    requests = 0
+
+    def do_GET(self):
+        OriginHandler.requests += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(PNG_BYTES)))
+        self.end_headers()
+        self.wfile.write(PNG_BYTES)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_origin():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), OriginHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def test_evicted_url_still_resolves():
+    """A local-only image evicted for the quota is downloaded again when its URL is requested"""
+    origin = start_origin()
+    try:
+        origin_url = f"http://127.0.0.1:{origin.server_port}/exam/image1.png"
+        stored_url = api.process_single_image(origin_url)
+        assert stored_url.startswith('/api/images/')
+        downloads = OriginHandler.requests
+
+        original_quota = api.LOCAL_STORAGE_QUOTA
+        api.LOCAL_STORAGE_QUOTA = 1
+        try:
+            assert api.evict_local_storage() == len(PNG_BYTES)
+        finally:
+            api.LOCAL_STORAGE_QUOTA = original_quota
+        assert api.image_index.lookup(origin_url) is not None
+
+        response = api.app.test_client().get(stored_url)
+        assert response.status_code == 200
+        assert response.get_data() == PNG_BYTES
+        assert OriginHandler.requests == downloads + 1
+        assert api.image_index.lookup(origin_url)['storage'] == 'local'
+        assert api.process_single_image(origin_url) == stored_url
+    finally:
+        origin.shutdown()
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f"✅ {name}")
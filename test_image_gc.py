@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Tests for the image garbage collector
+Runs against a scratch image directory and index, never the real ones
+"""
+
+import os
+import sys
+import hashlib
+import tempfile
+from types import SimpleNamespace
+
+# api.py reads its storage locations at import time
+SCRATCH_DIR = tempfile.mkdtemp(prefix='image-gc-test-')
+os.environ['IMAGES_DIR'] = os.path.join(SCRATCH_DIR, 'processed_images')
+os.environ['IMAGE_VARIANTS_DIR'] = os.path.join(SCRATCH_DIR, 'processed_variants')
+os.environ['IMAGE_INDEX_DB'] = os.path.join(SCRATCH_DIR, 'image_index.db')
+os.environ['METRICS_DIR'] = os.path.join(SCRATCH_DIR, 'metrics')
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import api
+import image_gc
+import image_storage
+
+REFERENCED_URL = 'https://img.examtopics.com/az-800/image1.png'
+TWO_DAYS = 2 * 24 * 3600
+
+def store_old_local_image(name):
+    """Write a local image two days old; returns (content_hash, path)"""
+    content_hash = hashlib.sha256(name.encode()).hexdigest()
+    path = image_storage.prepare_path(api.IMAGES_DIR, f"{content_hash}.png")
+    with open(path, 'wb') as f:
+        f.write(b'image bytes')
+    stamp = os.path.getmtime(path) - TWO_DAYS
+    os.utime(path, (stamp, stamp))
+    return content_hash, path
+
+def test_referenced_image_kept_when_index_missing():
+    """A fresh index knows no aliases; the stored image must survive anyway"""
+    content_hash, path = store_old_local_image('missing-index')
+    live_keys = image_gc.build_live_keys([REFERENCED_URL])
+
+    image_gc.collect_local(live_keys, image_gc.known_content_hashes(), 3600, dry_run=False)
+
+    assert os.path.exists(path)
+
+def collect_cloudinary_stub(public_ids, **kwargs):
+    """Run collect_cloudinary over old stub resources; returns the deleted public IDs"""
+    deleted = []
+    resources = [
+        {'public_id': f"{api.CLOUDINARY_FOLDER}/{public_id}", 'created_at': '2020-01-01T00:00:00Z', 'bytes': 10}
+        for public_id in public_ids
+    ]
+    original_cloudinary = image_gc.api.cloudinary
+    image_gc.api.cloudinary = SimpleNamespace(api=SimpleNamespace(
+        resources=lambda **kwargs: {'resources': resources},
+        delete_resources=deleted.extend
+    ))
+    try:
+        live_keys = image_gc.build_live_keys([REFERENCED_URL])
+        image_gc.collect_cloudinary(live_keys, image_gc.known_content_hashes(), 3600, dry_run=False, **kwargs)
+    finally:
+        image_gc.api.cloudinary = original_cloudinary
+    return deleted
+
+def test_cloudinary_resource_kept_when_index_missing():
+    """Unknown content hashes in Cloudinary are not deleted either"""
+    content_hash = hashlib.sha256(b'cloudinary-missing-index').hexdigest()
+    assert collect_cloudinary_stub([content_hash]) == []
+
+def test_cloudinary_upload_kept_without_include_uploads():
+    """Direct uploads from before content addressing are only deleted with include_uploads"""
+    assert collect_cloudinary_stub(['upload_1a2b3c4d']) == []
+    assert collect_cloudinary_stub(['upload_1a2b3c4d'], include_uploads=True) == [
+        f"{api.CLOUDINARY_FOLDER}/upload_1a2b3c4d"
+    ]
+
+def test_indexed_orphan_collected():
+    """An image the index knows, with no referenced alias, is still deleted"""
+    content_hash, path = store_old_local_image('indexed-orphan')
+    api.image_index.record('https://img.examtopics.com/old/removed.png', content_hash,
+                           f"/api/images/{content_hash}.png", 'local', 11)
+    live_keys = image_gc.build_live_keys([REFERENCED_URL])
+
+    image_gc.collect_local(live_keys, image_gc.known_content_hashes(), 3600, dry_run=False)
+
+    assert not os.path.exists(path)
+
+def test_indexed_referenced_image_kept():
+    """An image whose alias is referenced by a CSV is kept"""
+    content_hash, path = store_old_local_image('indexed-referenced')
+    api.image_index.record(REFERENCED_URL, content_hash, f"/api/images/{content_hash}.png", 'local', 11)
+    live_keys = image_gc.build_live_keys([REFERENCED_URL])
+
+    image_gc.collect_local(live_keys, image_gc.known_content_hashes(), 3600, dry_run=False)
+
+    assert os.path.exists(path)
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f"✅ {name}")